@@ -8,8 +8,33 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set in .env")
 
+# Compiled-statement LRU (SQLAlchemy default 500); sized for the app's distinct ORM queries
+QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+# Statement logging formats and writes every query; opt in for local debugging only
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
 # create SQLAlchemy engine (sync)
-engine = create_engine(DATABASE_URL, echo=True)
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite connections are handed across FastAPI's threadpool workers
+    engine = create_engine(DATABASE_URL, echo=SQL_ECHO, query_cache_size=QUERY_CACHE_SIZE, connect_args={"check_same_thread": False})
+else:
+    # Keep warm connections around for bursts of short write requests (likes/shares/comments);
+    # recycle stays under typical idle timeouts and TCP keepalives catch dead peers, so stale
+    # connections are replaced without a per-checkout SELECT 1. Turn DB_POOL_PRE_PING on only
+    # if dropped connections are still observed. pool_size + max_overflow (60) stays above
+    # FastAPI's 40-thread pool so sync endpoints never queue on a connection checkout.
+    engine = create_engine(
+        DATABASE_URL,
+        echo=SQL_ECHO,
+        query_cache_size=QUERY_CACHE_SIZE,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        pool_timeout=30,
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "false").lower() == "true",
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        # libpq (psycopg2) TCP keepalives detect dead peers in ~1 min instead of the OS default 2h
+        connect_args={"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 3},
+    )
 
 # dependency for FastAPI endpoints
 def get_session():
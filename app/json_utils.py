@@ -0,0 +1,28 @@
+"""JSON helpers for hot-path JSON: post tag columns, JWT payloads and the
+universities dataset.
+
+Uses orjson when installed and falls back to the stdlib otherwise; both
+produce/accept plain JSON, so stored values stay interchangeable.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+import json
+
+
+def loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
@@ -7,6 +7,7 @@ from app.db import engine
 from app.routers import profiles, files, users, posts, notes  # imports router modules
 from app.routers import chatbot
 from app.routers import rag
+from app.validators import get_allowed_email_domains
 
 app = FastAPI(title="Student Knowledge Platform - Backend")
 
@@ -45,6 +46,8 @@ def on_startup():
     # Create tables automatically on startup (convenient for development)
     SQLModel.metadata.create_all(engine)
     ensure_email_verification_schema()
+    # Parse universities.json now rather than on the first registration request
+    get_allowed_email_domains()
 
 @app.get("/")
 def root():
@@ -12,7 +12,7 @@ the new columns & constraints. For fresh dev databases this is fine.
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime, timezone
-from sqlalchemy import Column, String, DateTime, Integer, Boolean, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, Integer, Boolean, ForeignKey, Text, Index
 
 
 def utcnow() -> datetime:
@@ -104,6 +104,9 @@ class StudentProfileRead(SQLModel):
     avatar_url: Optional[str] = None
 
 class File(SQLModel, table=True):
+    # Covers the per-user SUM(size) quota query without touching the table heap
+    __table_args__ = (Index("idx_file_owner_size", "owner_id", "size"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str  # original user-provided filename (not trusted for storage path)
     filepath: str  # relative path from UPLOAD_DIR (e.g., "abc123.md")
@@ -173,6 +176,12 @@ class EmailVerification(SQLModel, table=True):
 
 
 class Post(SQLModel, table=True):
+    # Feed listings ORDER BY created_at DESC, optionally per author (indexes scanned backwards)
+    __table_args__ = (
+        Index("idx_post_created_at", "created_at"),
+        Index("idx_post_author_created", "author_id", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str = Field(sa_column=Column(String(500), nullable=False))
     body: str = Field(sa_column=Column(String(50000), nullable=False))
@@ -185,6 +194,19 @@ class Post(SQLModel, table=True):
     liked_by: str = Field(default="[]", sa_column=Column(String(10000), nullable=False))
     created_at: datetime = Field(default_factory=utcnow, sa_column=Column(DateTime(timezone=True), nullable=False))
     updated_at: datetime = Field(default_factory=utcnow, sa_column=Column(DateTime(timezone=True), nullable=False))
+    # Not eager by default: listings only need counts (grouped query in the posts router);
+    # use selectinload(Post.comments) when comment bodies are needed for a page of posts.
+    # Comment rows are removed by ON DELETE CASCADE, not loaded one by one.
+    comments: List["Comment"] = Relationship(
+        back_populates="post",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "passive_deletes": True},
+    )
+
+
+class PostLike(SQLModel, table=True):
+    # One row per (post, user) like; replaces the legacy Post.liked_by JSON list
+    post_id: int = Field(sa_column=Column(Integer, ForeignKey("post.id", ondelete="CASCADE"), primary_key=True))
+    user_id: int = Field(sa_column=Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True))
 
 
 class PostCreate(SQLModel):
@@ -210,8 +232,11 @@ class PostRead(SQLModel):
 
 
 class Comment(SQLModel, table=True):
+    # Comment thread: WHERE post_id = ? ORDER BY likes DESC, created_at DESC
+    __table_args__ = (Index("idx_comment_post_likes_created", "post_id", "likes", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    post_id: int = Field(sa_column=Column(Integer, ForeignKey("post.id"), nullable=False, index=True))
+    post_id: int = Field(sa_column=Column(Integer, ForeignKey("post.id", ondelete="CASCADE"), nullable=False, index=True))
     user_id: int = Field(sa_column=Column(Integer, ForeignKey("user.id"), nullable=False, index=True))
     user_name: str = Field(sa_column=Column(String(120), nullable=False))
     content: str = Field(sa_column=Column(String(5000), nullable=False))
@@ -219,6 +244,13 @@ class Comment(SQLModel, table=True):
     liked_by: str = Field(default="[]", sa_column=Column(String(10000), nullable=False, default="[]"))
     created_at: datetime = Field(default_factory=utcnow, sa_column=Column(DateTime(timezone=True), nullable=False))
     updated_at: datetime = Field(default_factory=utcnow, sa_column=Column(DateTime(timezone=True), nullable=False))
+    post: Optional[Post] = Relationship(back_populates="comments")
+
+
+class CommentLike(SQLModel, table=True):
+    # One row per (comment, user) like; replaces the legacy Comment.liked_by JSON list
+    comment_id: int = Field(sa_column=Column(Integer, ForeignKey("comment.id", ondelete="CASCADE"), primary_key=True))
+    user_id: int = Field(sa_column=Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True))
 
 
 class CommentCreate(SQLModel):
@@ -1,3 +1,4 @@
+import logging
 import os
 from typing import List, Literal, Optional, Dict, Any
 from fastapi import APIRouter, HTTPException
@@ -18,6 +19,7 @@ client = InferenceClient(
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 Role = Literal["user", "assistant", "system"]
 
@@ -114,7 +116,7 @@ def chat(req: ChatRequest):
                                     user = session.get(User, owner_id)
                                     owner_cache[owner_id] = user.name if user else "Unknown"
                         except Exception as e:
-                            print(f"Error fetching owner info: {e}")
+                            logger.warning("Error fetching owner info for user %s: %s", owner_id, e)
                             owner_cache[owner_id] = "Unknown"
                     
                     if owner_id:
@@ -164,8 +166,8 @@ def chat(req: ChatRequest):
                         base_sys = cfg.get("chat", {}).get("system_prompt", "")
                         combined = (base_sys + "\n\n" + instruction + "\n\n" + formatted).strip() if base_sys else (instruction + "\n\n" + formatted)
                         messages_payload.insert(0, {"role": "system", "content": combined})
-            except Exception as e:
-                print(f"RAG retrieval error: {e}")
+            except Exception:
+                logger.exception("RAG retrieval error")
 
     # Convert to structure expected by HF client (already matching openai style)
     try:
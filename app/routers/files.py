@@ -12,12 +12,16 @@ import tempfile
 import hashlib
 import zstandard as zstd
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.exceptions import InvalidTag
 import secrets
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
 from typing import Optional
 import threading
+import itertools
+import mmap
 
 from fastapi import (
     APIRouter,
@@ -29,8 +33,9 @@ from fastapi import (
     Response,
     Request,
 )
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlmodel import Session, select
+from sqlalchemy import func
 from app.db import get_session
 from app.models import File as FileModel, User
 
@@ -39,6 +44,11 @@ MAX_USER_TOTAL_BYTES = int(os.getenv("MAX_USER_STORAGE", str(200 * 1024 * 1024))
 ALLOWED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".txt", ".md", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", ".zip", ".rar", ".7z"}
 ENABLE_COMPRESSION = os.getenv("FILE_COMPRESSION", "true").lower() == "true"
 COMPRESSION_LEVEL = int(os.getenv("ZSTD_LEVEL", "6"))
+# Worker threads for zstd; the frame is split into jobs internally and the output format is unchanged
+COMPRESSION_THREADS = int(os.getenv("ZSTD_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+COPY_CHUNK_BYTES = 1024 * 1024  # read size for the upload copy loop
+# Skip compression when a fast probe of the first chunk saves less than 5%
+INCOMPRESSIBLE_RATIO = 0.95
 ENCRYPTION_KEY_HEX = os.getenv("FILE_ENCRYPTION_KEY")  # 64 hex chars for 32 bytes
 ENABLE_ENCRYPTION = bool(ENCRYPTION_KEY_HEX)
 if ENABLE_ENCRYPTION:
@@ -47,16 +57,31 @@ if ENABLE_ENCRYPTION:
         if len(_raw_key) != 32:
             raise ValueError("Encryption key must be 32 bytes (64 hex chars)")
         AES_GCM = AESGCM(_raw_key)
+        # Shared key object for the streaming GCM helpers; only the nonce changes per file
+        _AES_KEY = algorithms.AES(_raw_key)
     except Exception as e:
         raise RuntimeError(f"Invalid FILE_ENCRYPTION_KEY: {e}")
 else:
     AES_GCM = None  # type: ignore
+    _AES_KEY = None  # type: ignore
+GCM_NONCE_BYTES = 12
+GCM_TAG_BYTES = 16
+ZSTD_MAGIC = b"\x28\xB5\x2F\xFD"  # standard Zstd magic
+# Downloads up to this size are decrypted/decompressed fully before responding
+MAX_INMEMORY_BYTES = 50 * 1024 * 1024
 ALLOWED_MIME_PREFIXES = {"image/", "text/", "application/pdf", "application/msword", "application/vnd.", "application/zip", "application/x-", "application/octet-stream"}
 
 UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "./uploads")).resolve()
 
 # In-process user locks to reduce quota race conditions. Not cross-process.
-_user_locks: dict[int, threading.Lock] = {}
+# A fixed set of stripes keyed by user id: no per-user growth, and users that
+# share a stripe only serialize against each other briefly.
+_LOCK_STRIPES = 256
+_user_locks: list[threading.Lock] = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+
+def _user_lock(user_id: int) -> threading.Lock:
+    return _user_locks[user_id % _LOCK_STRIPES]
 
 # Ensure upload dir exists with owner-only perms (700 / rwx------)
 def _ensure_upload_dir():
@@ -74,22 +99,22 @@ except Exception:
     _jwt_current_user = None  # type: ignore
 
 def _current_user(request: Request, session: Session) -> User:
+    # Decode the JWT once per request; later calls reuse the resolved user
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
     if _jwt_current_user is None:
         raise HTTPException(status_code=500, detail="Auth subsystem unavailable")
-    return _jwt_current_user(request, session)
+    user = _jwt_current_user(request, session)
+    request.state.user = user
+    return user
 
 def _user_storage_bytes(session: Session, user_id: int) -> int:
-    total = 0
-    for f in session.exec(select(FileModel).where(FileModel.owner_id == user_id)).all():
-        if f.size:
-            total += f.size
-        else:
-            try:
-                full_path = UPLOAD_DIR / f.filepath
-                total += os.path.getsize(full_path)
-            except OSError:
-                pass
-    return total
+    # Single aggregate served from the (owner_id, size) index; sizes are recorded on upload
+    # and legacy NULL rows are filled in by backfill_file_sizes.py
+    return session.exec(
+        select(func.coalesce(func.sum(FileModel.size), 0)).where(FileModel.owner_id == user_id)
+    ).one()
 
 def _validate_extension(filename: str):
     ext = os.path.splitext(filename)[1].lower()
@@ -101,22 +126,80 @@ def _validate_content_type(sniffed: str):
     if not any(sniffed.startswith(pref) for pref in ALLOWED_MIME_PREFIXES):
         raise HTTPException(status_code=400, detail="Content type not allowed")
 
+# Known signatures keyed by the first four bytes read as a big-endian int
+_MAGIC_BY_HEAD4 = {
+    0x25504446: (b"%PDF", "application/pdf"),
+    0x89504E47: (b"\x89PNG\r\n\x1a\n", "image/png"),
+}
+
+# Everything except printable ASCII, tab, LF and CR
+_NON_TEXT_BYTES = bytes(b for b in range(256) if not (32 <= b <= 126 or b in (9, 10, 13)))
+
 def _sniff_magic(data: bytes) -> str:
-    # Minimal magic sniff (extend as needed)
-    if data.startswith(b"%PDF"):
-        return "application/pdf"
-    if data.startswith(b"\x89PNG\r\n\x1a\n"):
-        return "image/png"
-    if data.startswith(b"\xff\xd8"):
+    # Minimal magic sniff (extend as needed): one int lookup instead of a startswith chain
+    head4 = int.from_bytes(data[:4].ljust(4, b"\0"), "big")
+    hit = _MAGIC_BY_HEAD4.get(head4)
+    if hit is not None and data.startswith(hit[0]):
+        return hit[1]
+    if head4 >> 16 == 0xFFD8:
         return "image/jpeg"
-    # Fallback naive text detection
-    if all((32 <= b <= 126) or b in (9, 10, 13) for b in data[:128]):
+    # Fallback naive text detection: strip non-text bytes in C and see if anything was removed
+    sample = data[:128]
+    if len(sample.translate(None, _NON_TEXT_BYTES)) == len(sample):
         return "text/plain"
     return "application/octet-stream"
 
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # fdatasync is POSIX-only
+
+def _fsync_dir(path: Path):
+    # Persist the directory entry so the rename survives a crash (not supported on Windows)
+    if os.name == "nt":
+        return
+    dir_fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def _looks_incompressible(sample: bytes) -> bool:
+    # Cheap level-1 probe; catches already-compressed payloads the magic sniff doesn't know about
+    probe = zstd.ZstdCompressor(level=1).compress(sample)
+    return len(probe) > len(sample) * INCOMPRESSIBLE_RATIO
+
+class _HashingLimitingWriter:
+    """Write-through sink that hashes and size-checks bytes before forwarding them."""
+
+    def __init__(self, sink, hasher, limit: int):
+        self.sink = sink
+        self.hasher = hasher
+        self.limit = limit
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            raise HTTPException(status_code=413, detail="File too large")
+        self.hasher.update(data)
+        return self.sink.write(data)
+
+class _GcmEncryptingWriter:
+    """Encrypts bytes through an AES-GCM encryptor context before forwarding them to the sink."""
+
+    def __init__(self, sink, encryptor):
+        self.sink = sink
+        self.encryptor = encryptor
+
+    def write(self, data) -> int:
+        self.sink.write(self.encryptor.update(data))
+        return len(data)
+
+    def flush(self):
+        self.sink.flush()
+
 def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int, str, str, bool, bool, Optional[bytes], Optional[bytes]]:
     # Returns (final_path, size, content_type, checksum, compressed, encrypted, nonce, tag)
     tmp_fd, tmp_path = tempfile.mkstemp(dir=dest_dir)
+    # OpenSSL-backed (SHA-NI/AVX2 picked at runtime); fed 1 MiB at a time by the copy loop
     sha256 = hashlib.sha256()
     size = 0
     first_chunk = b""
@@ -126,38 +209,45 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
     tag: Optional[bytes] = None
 
     try:
+        # One handle from mkstemp through compression, encryption and fsync
         with os.fdopen(tmp_fd, "wb") as tmp_file:
+            # Layout when encrypting: nonce | ciphertext | tag, produced in a single pass
+            encryptor = None
+            sink = tmp_file
+            if ENABLE_ENCRYPTION and _AES_KEY:
+                nonce = secrets.token_bytes(GCM_NONCE_BYTES)
+                encryptor = _gcm_encryptor(nonce)
+                tmp_file.write(nonce)
+                sink = _GcmEncryptingWriter(tmp_file, encryptor)
+
             # We'll decide compression after sniffing the first chunk
             cstream = None
             should_compress = False
 
-            while True:
-                chunk = stream.read(64 * 1024)
-                if not chunk:
-                    break
-
-                if size == 0:
-                    # Capture initial bytes for content-type sniffing
-                    first_chunk = chunk[:512]
-                    sniff_type = _sniff_magic(first_chunk)
-                    # Compress all files except already-compressed formats (jpeg, png, zip, etc.)
-                    skip_compression_types = ["image/jpeg", "image/png", "image/gif", "image/webp", 
-                                             "application/zip", "application/x-rar", "application/x-7z"]
-                    if ENABLE_COMPRESSION and sniff_type not in skip_compression_types:
-                        should_compress = True
-                    # Initialize the output sink based on decision
-                    if should_compress:
-                        compressor = zstd.ZstdCompressor(level=COMPRESSION_LEVEL)
-                        cstream = compressor.stream_writer(tmp_file)
-                    else:
-                        cstream = tmp_file
+            head = stream.read(64 * 1024)
+            if head:
+                # Capture initial bytes for content-type sniffing
+                first_chunk = head[:512]
+                sniff_type = _sniff_magic(first_chunk)
+                # Compress all files except already-compressed formats (jpeg, png, zip, etc.)
+                skip_compression_types = ["image/jpeg", "image/png", "image/gif", "image/webp", 
+                                         "application/zip", "application/x-rar", "application/x-7z"]
+                if ENABLE_COMPRESSION and sniff_type not in skip_compression_types:
+                    should_compress = True
+                if should_compress and _looks_incompressible(head):
+                    should_compress = False
+                # Initialize the output sink based on decision
+                if should_compress:
+                    compressor = zstd.ZstdCompressor(level=COMPRESSION_LEVEL, threads=COMPRESSION_THREADS)
+                    cstream = compressor.stream_writer(sink, closefd=False)
+                else:
+                    cstream = sink
 
-                size += len(chunk)
-                if size > MAX_SINGLE_UPLOAD_BYTES:
-                    raise HTTPException(status_code=413, detail="File too large")
-                sha256.update(chunk)
-                # cstream is guaranteed to be set after first chunk
-                cstream.write(chunk)  # type: ignore[attr-defined]
+                # Hash + size-check on the way through; copyfileobj drives the rest in 1 MiB chunks
+                tap = _HashingLimitingWriter(cstream, sha256, MAX_SINGLE_UPLOAD_BYTES)
+                tap.write(head)
+                shutil.copyfileobj(stream, tap, length=COPY_CHUNK_BYTES)
+                size = tap.size
 
             # Finalize compressor if used
             if should_compress and cstream is not None:
@@ -171,21 +261,15 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
                         pass
                 compressed = True
 
-        # At this point file on disk has raw or compressed bytes. If encryption enabled, encrypt in-place.
-        if ENABLE_ENCRYPTION and AES_GCM:
-            with open(tmp_path, 'rb') as rf:
-                plaintext = rf.read()
-            nonce = secrets.token_bytes(12)
-            ciphertext = AES_GCM.encrypt(nonce, plaintext, None)
-            # Layout: nonce | ciphertext (AESGCM appends tag to ciphertext)
-            with open(tmp_path, 'wb') as wf:
-                wf.write(nonce + ciphertext)
-            encrypted = True
-            tag = ciphertext[-16:]
-
-        # fsync to disk before atomic move
-        with open(tmp_path, 'ab') as wf:
-            os.fsync(wf.fileno())
+            if encryptor is not None:
+                tmp_file.write(encryptor.finalize())
+                tag = encryptor.tag
+                tmp_file.write(tag)
+                encrypted = True
+
+            # Data-only sync before the atomic move; the directory fsync below covers the rename
+            tmp_file.flush()
+            _fdatasync(tmp_file.fileno())
 
         # Sniff type from first chunk for response metadata and validation
         content_type = _sniff_magic(first_chunk)
@@ -194,6 +278,7 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
         final_path = dest_dir / stored_name
         os.replace(tmp_path, final_path)  # atomic move
         os.chmod(final_path, stat.S_IRUSR | stat.S_IWUSR)  # 600
+        _fsync_dir(dest_dir)
         return final_path, size, content_type, sha256.hexdigest(), compressed, encrypted, nonce, tag
     except Exception:
         try:
@@ -202,6 +287,59 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
             pass
         raise
 
+def _gcm_encryptor(nonce: bytes):
+    return Cipher(_AES_KEY, modes.GCM(nonce)).encryptor()
+
+def _gcm_decryptor(nonce: bytes, tag: bytes):
+    return Cipher(_AES_KEY, modes.GCM(nonce, tag)).decryptor()
+
+def _mmap_readonly(fileno: int) -> mmap.mmap:
+    if os.name == "nt":
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    # Pre-fault the pages; in-memory downloads consume the whole file right away
+    return mmap.mmap(fileno, 0, flags=mmap.MAP_SHARED | getattr(mmap, "MAP_POPULATE", 0), prot=mmap.PROT_READ)
+
+def _iter_gcm_plaintext(rf, nonce: bytes, tag: bytes, ciphertext_len: int):
+    """Yield plaintext for `ciphertext_len` bytes read from `rf`; the tag is checked at finalize."""
+    decryptor = _gcm_decryptor(nonce, tag)
+    remaining = ciphertext_len
+    while remaining > 0:
+        chunk = rf.read(min(COPY_CHUNK_BYTES, remaining))
+        if not chunk:
+            raise ValueError("Truncated ciphertext")
+        remaining -= len(chunk)
+        yield decryptor.update(chunk)
+    decryptor.finalize()
+
+def _gcm_tag_ok(path: Path, nonce: bytes, tag: bytes, ciphertext_len: int) -> bool:
+    """
+    Decrypt-and-discard pass that checks the GCM tag before any plaintext is sent.
+    A streamed response can't change its status once the headers are out, so a tag
+    failure mid-stream would reach the client as a 200 with a truncated body.
+    """
+    try:
+        with open(path, 'rb') as rf:
+            rf.seek(GCM_NONCE_BYTES)
+            for _ in _iter_gcm_plaintext(rf, nonce, tag, ciphertext_len):
+                pass
+    except (InvalidTag, ValueError):
+        return False
+    return True
+
+def _iter_decompressed(chunks, compressed_flag: Optional[bool]):
+    """Pass chunks through a zstd decompressobj when stored compressed (flag or magic sniff)."""
+    first = next(chunks, b"")
+    if compressed_flag is True or (compressed_flag is None and bytes(first[:4]) == ZSTD_MAGIC):
+        dobj = zstd.ZstdDecompressor().decompressobj()
+        for piece in itertools.chain((first,), chunks):
+            out = dobj.decompress(piece)
+            if out:
+                yield out
+        return
+    if first:
+        yield first
+    yield from chunks
+
 router = APIRouter()
 @router.post("/", response_model=FileModel)
 def upload_file(
@@ -236,7 +374,7 @@ def upload_file(
     final_path, size, content_type, checksum, compressed, encrypted, nonce, tag = _atomic_write(file.file, UPLOAD_DIR, stored_name)
 
     # Use per-user in-process lock to reduce quota race between concurrent uploads
-    lock = _user_locks.setdefault(user.id, threading.Lock())
+    lock = _user_lock(user.id)
     with lock:
         # Recompute used after write to ensure we still have quota
         used_after = _user_storage_bytes(session, user.id)
@@ -316,74 +454,93 @@ def download_file(file_id: int, request: Request, session: Session = Depends(get
     if not path.exists():
         raise HTTPException(status_code=410, detail="File missing")
 
+    # Raw files are served as-is; FileResponse hands off to the server's zero-copy
+    # path send where supported instead of copying through Python.
+    if file_obj.is_encrypted is False and file_obj.is_compressed is False:
+        return FileResponse(
+            path,
+            media_type=_get_content_type(file_obj.filename),
+            filename=file_obj.filename,
+            headers={"X-Checksum-SHA256": file_obj.checksum_sha256 or ""},
+        )
+
     # For small files, process entirely in memory to avoid streaming
     # exceptions when an error occurs mid-stream. This ensures we only
     # start the response after successful decrypt+decompress.
-    MAX_INMEMORY_BYTES = 50 * 1024 * 1024  # 50 MB threshold
     file_size_on_disk = path.stat().st_size
     if file_size_on_disk <= MAX_INMEMORY_BYTES:
-        zstd_magic = b"\x28\xB5\x2F\xFD"
         data: bytes
-        with open(path, 'rb') as rf:
-            if bool(file_obj.is_encrypted):
-                if not AES_GCM:
-                    raise HTTPException(status_code=500, detail="Encryption key not configured")
-                nonce_local = rf.read(12)
-                if len(nonce_local) != 12:
-                    raise HTTPException(status_code=500, detail="Corrupt encrypted file")
-                ciphertext = rf.read()
-                try:
-                    data = AES_GCM.decrypt(nonce_local, ciphertext, None)
-                except Exception:
-                    raise HTTPException(status_code=410, detail="Unable to decrypt (key mismatch or corrupt)")
-            else:
-                data = rf.read()
-        # Decompress if needed (by metadata or magic)
-        if bool(file_obj.is_compressed) or (file_obj.is_compressed is None and data.startswith(zstd_magic)):
-            try:
-                dctx = zstd.ZstdDecompressor()
-                # Provide an explicit max_output_size to handle frames without known content size
-                max_out = file_obj.size or (100 * 1024 * 1024)
-                data = dctx.decompress(data, max_output_size=int(max_out))
-            except Exception:
-                # Fallback: return as-is (still valid to serve compressed bytes)
-                pass
+        if bool(file_obj.is_encrypted) and file_size_on_disk < GCM_NONCE_BYTES + GCM_TAG_BYTES:
+            # Too short to hold a nonce and tag; check before slicing the map
+            raise HTTPException(status_code=500, detail="Corrupt encrypted file")
+        if file_size_on_disk == 0:
+            data = b""  # mmap refuses empty files
+        else:
+            # Map the file rather than read() it: the page cache backs the view, so the
+            # ciphertext / compressed bytes are never copied into a Python bytes object.
+            with open(path, 'rb') as rf, _mmap_readonly(rf.fileno()) as mm, memoryview(mm) as view:
+                stored = view
+                if bool(file_obj.is_encrypted):
+                    if not AES_GCM:
+                        raise HTTPException(status_code=500, detail="Encryption key not configured")
+                    try:
+                        stored = AES_GCM.decrypt(bytes(view[:GCM_NONCE_BYTES]), view[GCM_NONCE_BYTES:], None)
+                    except Exception:
+                        raise HTTPException(status_code=410, detail="Unable to decrypt (key mismatch or corrupt)")
+                # Decompress if needed (by metadata or magic)
+                if bool(file_obj.is_compressed) or (file_obj.is_compressed is None and bytes(stored[:4]) == ZSTD_MAGIC):
+                    try:
+                        dctx = zstd.ZstdDecompressor()
+                        # Provide an explicit max_output_size to handle frames without known content size
+                        max_out = file_obj.size or (100 * 1024 * 1024)
+                        stored = dctx.decompress(stored, max_output_size=int(max_out))
+                    except Exception:
+                        # Fallback: return as-is (still valid to serve compressed bytes)
+                        pass
+                data = stored.tobytes() if isinstance(stored, memoryview) else stored
+                del stored  # release the view before the map closes
         headers = {
             "Content-Disposition": f"attachment; filename=\"{file_obj.filename}\"",
             "X-Checksum-SHA256": file_obj.checksum_sha256 or "",
         }
         return Response(content=data, media_type=_get_content_type(file_obj.filename), headers=headers)
 
-    # Fallback: streaming pipeline for larger files
+    # Fallback: streaming pipeline for larger files.
+    # If encrypted, the on-disk layout is: nonce(12) + ciphertext + tag(16). Header checks
+    # and tag verification happen here, before the response starts, so errors keep their status.
+    if file_obj.is_encrypted is True:
+        if not _AES_KEY:
+            raise HTTPException(status_code=500, detail="Encryption key not configured")
+        ciphertext_len = file_size_on_disk - GCM_NONCE_BYTES - GCM_TAG_BYTES
+        if ciphertext_len < 0:
+            raise HTTPException(status_code=500, detail="Corrupt encrypted file")
+        with open(path, 'rb') as rf:
+            nonce_local = rf.read(GCM_NONCE_BYTES)
+            rf.seek(-GCM_TAG_BYTES, os.SEEK_END)
+            tag_local = rf.read(GCM_TAG_BYTES)
+        # Costs a second AES pass over the file, which is cheap next to sending it
+        if not _gcm_tag_ok(path, nonce_local, tag_local, ciphertext_len):
+            raise HTTPException(status_code=410, detail="Unable to decrypt (key mismatch or corrupt)")
+
     def stream_pipeline():
-        zstd_magic = b"\x28\xB5\x2F\xFD"  # standard Zstd magic
-        # If encrypted, the on-disk layout is: nonce(12) + ciphertext (with tag at tail)
         with open(path, 'rb') as rf:
             plaintext = None
             # Decide encryption: prefer metadata, but if missing, attempt decrypt and fall back
             encrypted_flag = file_obj.is_encrypted
-            attempted_decrypt = False
             if encrypted_flag is True:
-                if not AES_GCM:
-                    raise HTTPException(status_code=500, detail="Encryption key not configured")
-                nonce_local = rf.read(12)
-                if len(nonce_local) != 12:
-                    raise HTTPException(status_code=500, detail="Corrupt encrypted file")
-                ciphertext = rf.read()
-                try:
-                    plaintext = AES_GCM.decrypt(nonce_local, ciphertext, None)
-                except Exception:
-                    raise HTTPException(status_code=410, detail="Unable to decrypt (key mismatch or corrupt)")
+                rf.seek(GCM_NONCE_BYTES)
+                # Tag already verified above; finalize re-checks it in case the file changed since
+                plain_chunks = _iter_gcm_plaintext(rf, nonce_local, tag_local, ciphertext_len)
+                yield from _iter_decompressed(plain_chunks, file_obj.is_compressed)
+                return
             elif encrypted_flag is None:
                 # Try to decrypt opportunistically; if it fails, treat as unencrypted
                 if AES_GCM:
-                    pos = rf.tell()
-                    nonce_local = rf.read(12)
-                    if len(nonce_local) == 12:
+                    sniff_nonce = rf.read(12)
+                    if len(sniff_nonce) == 12:
                         ciphertext = rf.read()
                         try:
-                            plaintext = AES_GCM.decrypt(nonce_local, ciphertext, None)
-                            attempted_decrypt = True
+                            plaintext = AES_GCM.decrypt(sniff_nonce, ciphertext, None)
                         except Exception:
                             # Not encrypted (or wrong key). Rewind and stream raw
                             rf.seek(0)
@@ -392,61 +549,16 @@ def download_file(file_id: int, request: Request, session: Session = Depends(get
                 # else: no key configured, proceed as unencrypted
             # else: encrypted_flag is False -> treat as unencrypted
 
-            # Compression handling based on metadata, with sniff fallback when missing
-            compressed_flag = file_obj.is_compressed
+            # Compression handling based on metadata, with sniff fallback when missing.
+            # Either source is decompressed incrementally, so the full plaintext is never built.
             if plaintext is not None:
                 # We have plaintext in memory (decrypted or originally unencrypted loaded by attempt)
-                if compressed_flag is True or (compressed_flag is None and plaintext.startswith(zstd_magic)):
-                    try:
-                        dctx = zstd.ZstdDecompressor()
-                        decompressed = dctx.decompress(plaintext)
-                    except Exception:
-                        # Fallback: serve plaintext as-is
-                        view = memoryview(plaintext)
-                        for offset in range(0, len(view), 64 * 1024):
-                            yield view[offset: offset + 64 * 1024]
-                        return
-                    view = memoryview(decompressed)
-                    for offset in range(0, len(view), 64 * 1024):
-                        yield view[offset: offset + 64 * 1024]
-                    return
-                else:
-                    view = memoryview(plaintext)
-                    for offset in range(0, len(view), 64 * 1024):
-                        yield view[offset: offset + 64 * 1024]
-                    return
+                view = memoryview(plaintext)
+                chunks = (view[offset: offset + COPY_CHUNK_BYTES] for offset in range(0, len(view), COPY_CHUNK_BYTES))
             else:
                 # No in-memory plaintext; we are in the unencrypted raw file path
-                if compressed_flag is True:
-                    dctx = zstd.ZstdDecompressor()
-                    with dctx.stream_reader(rf) as reader:
-                        while True:
-                            chunk = reader.read(64 * 1024)
-                            if not chunk:
-                                break
-                            yield chunk
-                    return
-                elif compressed_flag is None:
-                    # Sniff first 4 bytes for Zstd magic, then reset and choose path
-                    pos = rf.tell()
-                    head = rf.read(4)
-                    rf.seek(pos)
-                    if head == zstd_magic:
-                        dctx = zstd.ZstdDecompressor()
-                        with dctx.stream_reader(rf) as reader:
-                            while True:
-                                chunk = reader.read(64 * 1024)
-                                if not chunk:
-                                    break
-                                yield chunk
-                        return
-                # Not compressed: stream raw
-                with open(path, 'rb') as rf2:
-                    while True:
-                        chunk = rf2.read(64 * 1024)
-                        if not chunk:
-                            break
-                        yield chunk
+                chunks = iter(lambda: rf.read(COPY_CHUNK_BYTES), b"")
+            yield from _iter_decompressed(chunks, file_obj.is_compressed)
 
     headers = {
         "Content-Disposition": f"attachment; filename=\"{file_obj.filename}\"",
@@ -1,17 +1,19 @@
 # app/routers/notes.py
 import os
+import shutil
 import stat
 import tempfile
 import hashlib
 import zstandard as zstd
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 import secrets
+import base64
 from datetime import datetime
 from pathlib import Path
-from uuid import uuid4
 from typing import Optional, List
 import threading
-import io
+from concurrent.futures import ThreadPoolExecutor
+import logging
 
 from fastapi import (
     APIRouter,
@@ -20,13 +22,13 @@ from fastapi import (
     Form,
     Depends,
     HTTPException,
-    Response,
     Request,
 )
-from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
+from sqlalchemy import func, or_
+from sqlalchemy.orm import selectinload
 from app.db import get_session
-from app.models import File as FileModel, Note as NoteModel, User
+from app.models import File as FileModel, Note as NoteModel, NoteTag, User
 
 # Configuration from environment
 MAX_SINGLE_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_SIZE", str(25 * 1024 * 1024)))  # 25 MB default
@@ -34,6 +36,13 @@ MAX_USER_TOTAL_BYTES = int(os.getenv("MAX_USER_STORAGE", str(200 * 1024 * 1024))
 ALLOWED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".txt", ".md"}
 ENABLE_COMPRESSION = os.getenv("FILE_COMPRESSION", "true").lower() == "true"
 COMPRESSION_LEVEL = int(os.getenv("ZSTD_LEVEL", "6"))
+# Worker threads for zstd; the frame is split into jobs internally and the output format is unchanged
+COMPRESSION_THREADS = int(os.getenv("ZSTD_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+COPY_CHUNK_BYTES = 1024 * 1024  # read size for the upload copy loop
+# Upper bound on attachments written in parallel within one request
+ATTACHMENT_WRITE_WORKERS = int(os.getenv("ATTACHMENT_WRITE_WORKERS", "4"))
+# Skip compression when a fast probe of the first chunk saves less than 5%
+INCOMPRESSIBLE_RATIO = 0.95
 ENCRYPTION_KEY_HEX = os.getenv("FILE_ENCRYPTION_KEY")  # 64 hex chars for 32 bytes
 ENABLE_ENCRYPTION = bool(ENCRYPTION_KEY_HEX)
 
@@ -42,18 +51,27 @@ if ENABLE_ENCRYPTION:
         _raw_key = bytes.fromhex(ENCRYPTION_KEY_HEX)
         if len(_raw_key) != 32:
             raise ValueError("Encryption key must be 32 bytes (64 hex chars)")
-        AES_GCM = AESGCM(_raw_key)
+        # Shared key object for the streaming GCM encryptor; only the nonce changes per file
+        _AES_KEY = algorithms.AES(_raw_key)
     except Exception as e:
         raise RuntimeError(f"Invalid FILE_ENCRYPTION_KEY: {e}")
 else:
-    AES_GCM = None  # type: ignore
+    _AES_KEY = None  # type: ignore
+GCM_NONCE_BYTES = 12
 
 ALLOWED_MIME_PREFIXES = {"image/", "text/", "application/pdf"}
 
 UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "./uploads")).resolve()
 
 # In-process user locks to reduce quota race conditions. Not cross-process.
-_user_locks: dict[int, threading.Lock] = {}
+# A fixed set of stripes keyed by user id: no per-user growth, and users that
+# share a stripe only serialize against each other briefly.
+_LOCK_STRIPES = 256
+_user_locks: list[threading.Lock] = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+
+def _user_lock(user_id: int) -> threading.Lock:
+    return _user_locks[user_id % _LOCK_STRIPES]
 
 # Ensure upload dir exists with owner-only perms (700 / rwx------)
 def _ensure_upload_dir():
@@ -71,21 +89,22 @@ except Exception:
     _jwt_current_user = None  # type: ignore
 
 def _current_user(request: Request, session: Session) -> User:
+    # Decode the JWT once per request; later calls reuse the resolved user
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
     if _jwt_current_user is None:
         raise HTTPException(status_code=500, detail="Auth subsystem unavailable")
-    return _jwt_current_user(request, session)
+    user = _jwt_current_user(request, session)
+    request.state.user = user
+    return user
 
 def _user_storage_bytes(session: Session, user_id: int) -> int:
-    total = 0
-    for f in session.exec(select(FileModel).where(FileModel.owner_id == user_id)).all():
-        if f.size:
-            total += f.size
-        else:
-            try:
-                total += os.path.getsize(f.filepath)
-            except OSError:
-                pass
-    return total
+    # Single aggregate served from the (owner_id, size) index; sizes are recorded on upload
+    # and legacy NULL rows are filled in by backfill_file_sizes.py
+    return session.exec(
+        select(func.coalesce(func.sum(FileModel.size), 0)).where(FileModel.owner_id == user_id)
+    ).one()
 
 def _validate_extension(filename: str):
     ext = os.path.splitext(filename)[1].lower()
@@ -97,64 +116,144 @@ def _validate_content_type(sniffed: str):
     if not any(sniffed.startswith(pref) for pref in ALLOWED_MIME_PREFIXES):
         raise HTTPException(status_code=400, detail="Content type not allowed")
 
+# Known signatures keyed by the first four bytes read as a big-endian int
+_MAGIC_BY_HEAD4 = {
+    0x25504446: (b"%PDF", "application/pdf"),
+    0x89504E47: (b"\x89PNG\r\n\x1a\n", "image/png"),
+}
+
+# Everything except printable ASCII, tab, LF and CR
+_NON_TEXT_BYTES = bytes(b for b in range(256) if not (32 <= b <= 126 or b in (9, 10, 13)))
+
 def _sniff_magic(data: bytes) -> str:
-    # Minimal magic sniff (extend as needed)
-    if data.startswith(b"%PDF"):
-        return "application/pdf"
-    if data.startswith(b"\x89PNG\r\n\x1a\n"):
-        return "image/png"
-    if data.startswith(b"\xff\xd8"):
+    # Minimal magic sniff (extend as needed): one int lookup instead of a startswith chain
+    head4 = int.from_bytes(data[:4].ljust(4, b"\0"), "big")
+    hit = _MAGIC_BY_HEAD4.get(head4)
+    if hit is not None and data.startswith(hit[0]):
+        return hit[1]
+    if head4 >> 16 == 0xFFD8:
         return "image/jpeg"
-    # Fallback naive text detection
-    if all((32 <= b <= 126) or b in (9, 10, 13) for b in data[:128]):
+    # Fallback naive text detection: strip non-text bytes in C and see if anything was removed
+    sample = data[:128]
+    if len(sample.translate(None, _NON_TEXT_BYTES)) == len(sample):
         return "text/plain"
     return "application/octet-stream"
 
-def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int, str, str, bool, bool, Optional[bytes], Optional[bytes]]:
+def _gcm_encryptor(nonce: bytes):
+    return Cipher(_AES_KEY, modes.GCM(nonce)).encryptor()
+
+def _gcm_nonces(count: int) -> list[Optional[bytes]]:
+    """Draw `count` GCM nonces from one urandom call (all None when encryption is off)."""
+    if not (ENABLE_ENCRYPTION and _AES_KEY):
+        return [None] * count
+    pool = os.urandom(GCM_NONCE_BYTES * count)
+    return [pool[i:i + GCM_NONCE_BYTES] for i in range(0, len(pool), GCM_NONCE_BYTES)]
+
+def _stored_tokens(count: int) -> list[str]:
+    """`count` url-safe storage tokens (as secrets.token_urlsafe(16)) from one urandom call."""
+    pool = os.urandom(16 * count)
+    return [base64.urlsafe_b64encode(pool[i:i + 16]).rstrip(b"=").decode("ascii") for i in range(0, len(pool), 16)]
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # fdatasync is POSIX-only
+
+def _fsync_dir(path: Path):
+    # Persist the directory entry so the rename survives a crash (not supported on Windows)
+    if os.name == "nt":
+        return
+    dir_fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def _looks_incompressible(sample: bytes) -> bool:
+    # Cheap level-1 probe; catches already-compressed payloads the magic sniff doesn't know about
+    probe = zstd.ZstdCompressor(level=1).compress(sample)
+    return len(probe) > len(sample) * INCOMPRESSIBLE_RATIO
+
+class _HashingLimitingWriter:
+    """Write-through sink that hashes and size-checks bytes before forwarding them."""
+
+    def __init__(self, sink, hasher, limit: int):
+        self.sink = sink
+        self.hasher = hasher
+        self.limit = limit
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            raise HTTPException(status_code=413, detail="File too large")
+        self.hasher.update(data)
+        return self.sink.write(data)
+
+class _GcmEncryptingWriter:
+    """Encrypts bytes through an AES-GCM encryptor context before forwarding them to the sink."""
+
+    def __init__(self, sink, encryptor):
+        self.sink = sink
+        self.encryptor = encryptor
+
+    def write(self, data) -> int:
+        self.sink.write(self.encryptor.update(data))
+        return len(data)
+
+    def flush(self):
+        self.sink.flush()
+
+def _atomic_write(stream, dest_dir: Path, stored_name: str, nonce: Optional[bytes] = None) -> tuple[Path, int, str, str, bool, bool, Optional[bytes], Optional[bytes]]:
     """
     Write file atomically with optional compression and encryption.
+    `nonce` may be pre-drawn via _gcm_nonces; one is generated when omitted.
     Returns (final_path, size, content_type, checksum, compressed, encrypted, nonce, tag)
     """
     tmp_fd, tmp_path = tempfile.mkstemp(dir=dest_dir)
+    # OpenSSL-backed (SHA-NI/AVX2 picked at runtime); fed 1 MiB at a time by the copy loop
     sha256 = hashlib.sha256()
     size = 0
     first_chunk = b""
     compressed = False
     encrypted = False
-    nonce: Optional[bytes] = None
     tag: Optional[bytes] = None
 
     try:
+        # One handle from mkstemp through compression, encryption and fsync
         with os.fdopen(tmp_fd, "wb") as tmp_file:
+            # Layout when encrypting: nonce | ciphertext | tag, produced in a single pass
+            encryptor = None
+            sink = tmp_file
+            if ENABLE_ENCRYPTION and _AES_KEY:
+                nonce = nonce or secrets.token_bytes(GCM_NONCE_BYTES)
+                encryptor = _gcm_encryptor(nonce)
+                tmp_file.write(nonce)
+                sink = _GcmEncryptingWriter(tmp_file, encryptor)
+
             # We'll decide compression after sniffing the first chunk
             cstream = None
             should_compress = False
 
-            while True:
-                chunk = stream.read(64 * 1024)
-                if not chunk:
-                    break
-
-                if size == 0:
-                    # Capture initial bytes for content-type sniffing
-                    first_chunk = chunk[:512]
-                    sniff_type = _sniff_magic(first_chunk)
-                    # Skip compression for already-compressed image formats
-                    if ENABLE_COMPRESSION and not sniff_type.startswith("image/"):
-                        should_compress = True
-                    # Initialize the output sink based on decision
-                    if should_compress:
-                        compressor = zstd.ZstdCompressor(level=COMPRESSION_LEVEL)
-                        cstream = compressor.stream_writer(tmp_file)
-                    else:
-                        cstream = tmp_file
-
-                size += len(chunk)
-                if size > MAX_SINGLE_UPLOAD_BYTES:
-                    raise HTTPException(status_code=413, detail="File too large")
-                sha256.update(chunk)
-                # cstream is guaranteed to be set after first chunk
-                cstream.write(chunk)  # type: ignore[attr-defined]
+            head = stream.read(64 * 1024)
+            if head:
+                # Capture initial bytes for content-type sniffing
+                first_chunk = head[:512]
+                sniff_type = _sniff_magic(first_chunk)
+                # Skip compression for already-compressed image formats
+                if ENABLE_COMPRESSION and not sniff_type.startswith("image/"):
+                    should_compress = True
+                if should_compress and _looks_incompressible(head):
+                    should_compress = False
+                # Initialize the output sink based on decision
+                if should_compress:
+                    compressor = zstd.ZstdCompressor(level=COMPRESSION_LEVEL, threads=COMPRESSION_THREADS)
+                    cstream = compressor.stream_writer(sink, closefd=False)
+                else:
+                    cstream = sink
+
+                # Hash + size-check on the way through; copyfileobj drives the rest in 1 MiB chunks
+                tap = _HashingLimitingWriter(cstream, sha256, MAX_SINGLE_UPLOAD_BYTES)
+                tap.write(head)
+                shutil.copyfileobj(stream, tap, length=COPY_CHUNK_BYTES)
+                size = tap.size
 
             # Finalize compressor if used
             if should_compress and cstream is not None:
@@ -168,21 +267,15 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
                         pass
                 compressed = True
 
-        # At this point file on disk has raw or compressed bytes. If encryption enabled, encrypt in-place.
-        if ENABLE_ENCRYPTION and AES_GCM:
-            with open(tmp_path, 'rb') as rf:
-                plaintext = rf.read()
-            nonce = secrets.token_bytes(12)
-            ciphertext = AES_GCM.encrypt(nonce, plaintext, None)
-            # Layout: nonce | ciphertext (AESGCM appends tag to ciphertext)
-            with open(tmp_path, 'wb') as wf:
-                wf.write(nonce + ciphertext)
-            encrypted = True
-            tag = ciphertext[-16:]
-
-        # fsync to disk before atomic move
-        with open(tmp_path, 'ab') as wf:
-            os.fsync(wf.fileno())
+            if encryptor is not None:
+                tmp_file.write(encryptor.finalize())
+                tag = encryptor.tag
+                tmp_file.write(tag)
+                encrypted = True
+
+            # Data-only sync before the atomic move; the directory fsync below covers the rename
+            tmp_file.flush()
+            _fdatasync(tmp_file.fileno())
 
         # Sniff type from first chunk for response metadata and validation
         content_type = _sniff_magic(first_chunk)
@@ -191,6 +284,7 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
         final_path = dest_dir / stored_name
         os.replace(tmp_path, final_path)  # atomic move
         os.chmod(final_path, stat.S_IRUSR | stat.S_IWUSR)  # 600
+        _fsync_dir(dest_dir)
         return final_path, size, content_type, sha256.hexdigest(), compressed, encrypted, nonce, tag
     except Exception:
         try:
@@ -199,6 +293,149 @@ def _atomic_write(stream, dest_dir: Path, stored_name: str) -> tuple[Path, int,
             pass
         raise
 
+def _atomic_write_bytes(data: bytes, dest_dir: Path, stored_name: str, nonce: Optional[bytes] = None) -> tuple[Path, int, str, str, bool, bool, Optional[bytes], Optional[bytes]]:
+    """
+    In-memory counterpart of _atomic_write for note content we already hold as bytes:
+    one hash, one compress and one encrypt call instead of the chunked copy loop.
+    Returns the same tuple as _atomic_write.
+    """
+    size = len(data)
+    if size > MAX_SINGLE_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    content_type = _sniff_magic(data[:512])
+    _validate_content_type(content_type)
+    checksum = hashlib.sha256(data).hexdigest()
+
+    compressed = bool(
+        data
+        and ENABLE_COMPRESSION
+        and not content_type.startswith("image/")
+        and not _looks_incompressible(data[:64 * 1024])
+    )
+    payload = zstd.ZstdCompressor(level=COMPRESSION_LEVEL).compress(data) if compressed else data
+
+    encrypted = False
+    tag: Optional[bytes] = None
+    if ENABLE_ENCRYPTION and _AES_KEY:
+        nonce = nonce or secrets.token_bytes(GCM_NONCE_BYTES)
+        encryptor = _gcm_encryptor(nonce)
+        payload = encryptor.update(payload) + encryptor.finalize()
+        tag = encryptor.tag
+        encrypted = True
+
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=dest_dir)
+    try:
+        with os.fdopen(tmp_fd, "wb") as tmp_file:
+            if encrypted:
+                tmp_file.write(nonce)
+            tmp_file.write(payload)
+            if encrypted:
+                tmp_file.write(tag)
+            tmp_file.flush()
+            _fdatasync(tmp_file.fileno())
+
+        final_path = dest_dir / stored_name
+        os.replace(tmp_path, final_path)  # atomic move
+        os.chmod(final_path, stat.S_IRUSR | stat.S_IWUSR)  # 600
+        _fsync_dir(dest_dir)
+        return final_path, size, content_type, checksum, compressed, encrypted, nonce, tag
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_attachments(pending: list) -> list:
+    """
+    Run _atomic_write for each (upload, stored_name, nonce) in `pending`, in parallel when
+    there are several (zstd, OpenSSL and file I/O all release the GIL). Results keep input
+    order; if any write fails, the files that did land are removed and the error re-raised.
+    """
+    if len(pending) <= 1:
+        return [_atomic_write(upload.file, UPLOAD_DIR, name, nonce=n) for upload, name, n in pending]
+    with ThreadPoolExecutor(max_workers=min(ATTACHMENT_WRITE_WORKERS, len(pending))) as pool:
+        futures = [pool.submit(_atomic_write, upload.file, UPLOAD_DIR, name, nonce=n) for upload, name, n in pending]
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for written in results:
+            try:
+                os.remove(written[0])
+            except OSError:
+                pass
+        raise error
+    return results
+
+
+def _remove_files(paths: list) -> None:
+    # Best-effort cleanup of files written by a request whose transaction was rolled back
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+logger = logging.getLogger(__name__)
+
+# RAG (re)indexing runs the embedding model, so it is handed to one background worker
+# instead of holding up the response. A single worker applies jobs in submission order,
+# e.g. an index followed by a removal of the same note. Jobs are in-process only: any
+# still queued when the process exits are lost and picked up by the next edit/reindex.
+_rag_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-index")
+
+# Positional-only so fn's own keyword arguments (e.g. note_id=) pass through untouched
+def _run_rag_job(description: str, job_note_id: int, fn, /, *args, **kwargs):
+    try:
+        fn(*args, **kwargs)
+        logger.info("RAG %s done for note %d", description, job_note_id)
+    except Exception as e:
+        # Never surfaces to the client; the request finished long ago
+        logger.warning("RAG %s failed for note %d: %s", description, job_note_id, e)
+
+def _queue_rag_job(description: str, job_note_id: int, fn, /, *args, **kwargs):
+    _rag_worker.submit(_run_rag_job, description, job_note_id, fn, *args, **kwargs)
+
+def _serialize_note(note: NoteModel, *, include_author: bool = False) -> dict:
+    """Response shape shared by the read endpoints; expects files/tags (and owner.profiles
+    when include_author) to be eager-loaded so this issues no queries."""
+    content_file = None
+    attachments = []
+    for file in note.files:
+        if file.file_type == "content":
+            content_file = file
+        elif file.file_type == "attachment":
+            attachments.append({
+                "id": file.id,
+                "filename": file.filename,
+                "size": file.size
+            })
+    
+    data = {
+        "id": note.id,
+        "title": note.title,
+        "subject": note.subject,
+        "visibility": note.visibility,
+        "content_file_id": content_file.id if content_file else None,
+        "attachments": attachments,
+        "tags": [tag.tag for tag in note.tags],
+    }
+    if include_author:
+        user = note.owner
+        profile = user.profiles[0] if user and user.profiles else None
+        data["author"] = {
+            "name": profile.name if profile else user.name if user else "Unknown",
+            "username": profile.username if profile else None,
+        }
+    data["created_at"] = note.created_at.isoformat()
+    data["updated_at"] = note.updated_at.isoformat()
+    return data
 
 router = APIRouter()
 
@@ -245,34 +482,63 @@ def create_note(
     if used >= MAX_USER_TOTAL_BYTES:
         raise HTTPException(status_code=403, detail="Storage quota exceeded")
     
-    # Use per-user lock to prevent race conditions
-    lock = _user_locks.setdefault(user.id, threading.Lock())
+    # One timestamp for the note and every row created with it
+    now = datetime.utcnow()
+    now_iso = now.isoformat() + "Z"
     
-    with lock:
-        try:
+    # Files on disk for this request, removed again if it doesn't commit
+    written_paths: list[Path] = []
+    try:
+        # One entropy draw covers the content file and every attachment
+        nonces = iter(_gcm_nonces(1 + len(attachments)))
+        tokens = iter(_stored_tokens(1 + len(attachments)))
+        
+        # Now process and save the content as a file
+        content_bytes = content.encode('utf-8')
+        
+        stored_token = next(tokens)
+        stored_name = f"{stored_token}.md"
+        
+        final_path, size, content_type, checksum, compressed, encrypted, nonce, tag = _atomic_write_bytes(
+            content_bytes, UPLOAD_DIR, stored_name, nonce=next(nonces)
+        )
+        written_paths.append(final_path)
+        
+        # Validate and name every attachment up front, then write them concurrently
+        pending = []
+        for attachment in attachments:
+            if not attachment.filename:
+                continue
+            
+            # Validate extension
+            ext = _validate_extension(attachment.filename)
+            
+            # Generate unique storage name
+            attach_token = next(tokens)
+            pending.append((attachment, f"{attach_token}{ext}", next(nonces)))
+        
+        written_attachments = _write_attachments(pending)
+        written_paths.extend(written[0] for written in written_attachments)
+        
+        # File I/O happens above, outside the lock; the stripe is held only for the quota
+        # re-check and the INSERTs, so users sharing a stripe never wait on each other's uploads
+        with _user_lock(user.id):
+            new_bytes = size + sum(written[1] for written in written_attachments)
+            if _user_storage_bytes(session, user.id) + new_bytes > MAX_USER_TOTAL_BYTES:
+                raise HTTPException(status_code=403, detail="Storage quota exceeded")
+            
             # Create the note record first (without files)
             note = NoteModel(
                 user_id=user.id,
                 title=title,
                 subject=subject if subject else None,
                 visibility=visibility,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
+                created_at=now,
+                updated_at=now
             )
             session.add(note)
-            session.commit()
-            session.refresh(note)
-            
-            # Now process and save the content as a file
-            content_bytes = content.encode('utf-8')
-            content_stream = io.BytesIO(content_bytes)
-            
-            stored_token = secrets.token_urlsafe(16)
-            stored_name = f"{stored_token}.md"
-            
-            final_path, size, content_type, checksum, compressed, encrypted, nonce, tag = _atomic_write(
-                content_stream, UPLOAD_DIR, stored_name
-            )
+            # Flush only to get note.id; everything below lands in the same transaction
+            session.flush()
             
             # Create file record for content
             content_file = FileModel(
@@ -287,27 +553,13 @@ def create_note(
                 is_encrypted=bool(encrypted),
                 encryption_nonce_hex=(nonce.hex() if nonce else None),
                 encryption_tag_hex=(tag.hex() if tag else None),
-                uploaded_at=datetime.utcnow().isoformat() + "Z",
+                uploaded_at=now_iso,
             )
             session.add(content_file)
             
-            # Process attachments
             attachment_files = []
-            for attachment in attachments:
-                if not attachment.filename:
-                    continue
-                
-                # Validate extension
-                ext = _validate_extension(attachment.filename)
-                
-                # Generate unique storage name
-                attach_token = secrets.token_urlsafe(16)
-                attach_stored_name = f"{attach_token}{ext}"
-                
-                # Write attachment with compression/encryption
-                attach_path, attach_size, attach_type, attach_checksum, attach_compressed, attach_encrypted, attach_nonce, attach_tag = _atomic_write(
-                    attachment.file, UPLOAD_DIR, attach_stored_name
-                )
+            for (attachment, attach_stored_name, _), written in zip(pending, written_attachments):
+                attach_path, attach_size, attach_type, attach_checksum, attach_compressed, attach_encrypted, attach_nonce, attach_tag = written
                 
                 # Create file record for attachment
                 attachment_file = FileModel(
@@ -322,54 +574,27 @@ def create_note(
                     is_encrypted=bool(attach_encrypted),
                     encryption_nonce_hex=(attach_nonce.hex() if attach_nonce else None),
                     encryption_tag_hex=(attach_tag.hex() if attach_tag else None),
-                    uploaded_at=datetime.utcnow().isoformat() + "Z",
+                    uploaded_at=now_iso,
                 )
-                session.add(attachment_file)
                 attachment_files.append(attachment_file)
+            session.add_all(attachment_files)
             
             # Create tag records
-            from app.models import NoteTag
-            tag_records = []
-            for tag_name in tag_list:
-                tag_name = tag_name.strip()
-                if tag_name:  # Skip empty tags
-                    tag_record = NoteTag(
-                        note_id=note.id,
-                        tag=tag_name[:50],  # Limit to 50 chars
-                        created_at=datetime.utcnow()
-                    )
-                    session.add(tag_record)
-                    tag_records.append(tag_record)
-            
-            # Commit all file and tag records
-            session.commit()
-            
-            # Refresh to get IDs
-            session.refresh(note)
-            session.refresh(content_file)
-            for af in attachment_files:
-                session.refresh(af)
-            
-            # Index note if it's public (before encryption, using plain content)
-            if visibility == "public":
-                try:
-                    from app.rag_engine import index_note_from_content
-                    
-                    # We already have the plain content in memory, no need to decrypt
-                    # Just pass it directly for indexing
-                    index_note_from_content(
-                        note_id=note.id,
-                        note_title=note.title,
-                        owner_id=user.id,
-                        content_text=content,
-                        attachments=[]  # Attachments will need separate handling if needed
-                    )
-                    print(f"Successfully indexed public note {note.id} into RAG")
-                except Exception as e:
-                    # Don't fail the request if indexing fails
-                    print(f"Warning: Failed to index note {note.id}: {e}")
+            tag_records = [
+                NoteTag(
+                    note_id=note.id,
+                    tag=tag_name.strip()[:50],  # Limit to 50 chars
+                    created_at=now
+                )
+                for tag_name in tag_list
+                if tag_name.strip()  # Skip empty tags
+            ]
+            session.add_all(tag_records)
             
-            return {
+            # One flush batches the file and tag INSERTs and assigns their IDs;
+            # build the response now so nothing needs reloading after commit
+            session.flush()
+            response = {
                 "id": note.id,
                 "title": note.title,
                 "subject": note.subject,
@@ -381,13 +606,39 @@ def create_note(
                 "updated_at": note.updated_at.isoformat(),
                 "message": "Note created successfully"
             }
-            
-        except HTTPException:
-            session.rollback()
-            raise
-        except Exception as e:
-            session.rollback()
-            raise HTTPException(status_code=500, detail=f"Failed to create note: {str(e)}")
+            session.commit()
+        written_paths.clear()  # committed: the rows own these files now
+        
+        # Index note if it's public (before encryption, using plain content)
+        if visibility == "public":
+            try:
+                from app.rag_engine import index_note_from_content
+                
+                # We already have the plain content in memory, no need to decrypt
+                # Just pass it directly for indexing
+                _queue_rag_job(
+                    "index", response["id"],
+                    index_note_from_content,
+                    note_id=response["id"],
+                    note_title=title,
+                    owner_id=user.id,
+                    content_text=content,
+                    attachments=[]  # Attachments will need separate handling if needed
+                )
+            except Exception as e:
+                # Don't fail the request if indexing fails
+                logger.warning("Failed to index note %d: %s", response["id"], e)
+        
+        return response
+        
+    except HTTPException:
+        session.rollback()
+        _remove_files(written_paths)
+        raise
+    except Exception as e:
+        session.rollback()
+        _remove_files(written_paths)
+        raise HTTPException(status_code=500, detail=f"Failed to create note: {str(e)}")
 
 
 @router.get("/search")
@@ -405,89 +656,36 @@ def search_notes(
     - **limit**: Maximum number of notes to return
     - **offset**: Number of notes to skip
     """
-    from app.models import NoteTag
-    
     if not q or not q.strip():
         return {"notes": [], "total": 0}
     
     search_term = f"%{q.strip().lower()}%"
     
-    # Search in titles (case-insensitive)
-    title_query = select(NoteModel).where(
+    # Single query over titles and tags (case-insensitive); DISTINCT dedupes notes matching both.
+    # On Postgres the '%term%' ILIKEs are served by the trigram indexes from migrations/004.
+    matching_ids = select(NoteModel.id).outerjoin(NoteTag).where(
         NoteModel.visibility == "public",
-        NoteModel.title.ilike(search_term)
-    )
-    
-    # Search in tags
-    tag_query = select(NoteModel).join(NoteTag).where(
-        NoteModel.visibility == "public",
-        NoteTag.tag.ilike(search_term)
-    )
+        or_(NoteModel.title.ilike(search_term), NoteTag.tag.ilike(search_term)),
+    ).distinct()
+    total = session.exec(select(func.count()).select_from(matching_ids.subquery())).one()
+    
+    # Pagination happens in the database; files, tags and author are batch-loaded
+    paginated_notes = session.exec(
+        select(NoteModel)
+        .where(NoteModel.id.in_(matching_ids))
+        .order_by(NoteModel.id)
+        .offset(offset)
+        .limit(limit)
+        .options(
+            selectinload(NoteModel.files),
+            selectinload(NoteModel.tags),
+            selectinload(NoteModel.owner).selectinload(User.profiles),
+        )
+    ).all()
     
-    # Combine results (using union to avoid duplicates)
-    notes_from_title = session.exec(title_query).all()
-    notes_from_tags = session.exec(tag_query).all()
-    
-    # Combine and deduplicate by note ID
-    note_ids = set()
-    unique_notes = []
-    for note in list(notes_from_title) + list(notes_from_tags):
-        if note.id not in note_ids:
-            note_ids.add(note.id)
-            unique_notes.append(note)
-    
-    # Apply pagination
-    paginated_notes = unique_notes[offset:offset + limit]
-    
-    result = []
-    for note in paginated_notes:
-        # Get associated files
-        files = session.exec(
-            select(FileModel).where(FileModel.note_id == note.id)
-        ).all()
-        
-        content_file = None
-        attachments = []
-        for file in files:
-            if file.file_type == "content":
-                content_file = file
-            elif file.file_type == "attachment":
-                attachments.append({
-                    "id": file.id,
-                    "filename": file.filename,
-                    "size": file.size
-                })
-        
-        # Get tags
-        tags = session.exec(
-            select(NoteTag).where(NoteTag.note_id == note.id)
-        ).all()
-        tag_list = [tag.tag for tag in tags]
-        
-        # Get author info
-        from app.models import User, StudentProfile
-        user = session.get(User, note.user_id)
-        profile = session.exec(
-            select(StudentProfile).where(StudentProfile.user_id == note.user_id)
-        ).first()
-        
-        result.append({
-            "id": note.id,
-            "title": note.title,
-            "subject": note.subject,
-            "visibility": note.visibility,
-            "content_file_id": content_file.id if content_file else None,
-            "attachments": attachments,
-            "tags": tag_list,
-            "author": {
-                "name": profile.name if profile else user.name if user else "Unknown",
-                "username": profile.username if profile else None,
-            },
-            "created_at": note.created_at.isoformat(),
-            "updated_at": note.updated_at.isoformat(),
-        })
+    result = [_serialize_note(note, include_author=True) for note in paginated_notes]
     
-    return {"notes": result, "total": len(unique_notes)}
+    return {"notes": result, "total": total}
 
 
 @router.get("/")
@@ -512,46 +710,12 @@ def list_notes(
     if visibility and visibility.lower() in {"private", "public"}:
         query = query.where(NoteModel.visibility == visibility.lower())
     
-    query = query.offset(offset).limit(limit)
+    query = query.offset(offset).limit(limit).options(
+        selectinload(NoteModel.files), selectinload(NoteModel.tags)
+    )
     notes = session.exec(query).all()
     
-    result = []
-    for note in notes:
-        # Get associated files
-        files = session.exec(
-            select(FileModel).where(FileModel.note_id == note.id)
-        ).all()
-        
-        content_file = None
-        attachments = []
-        for file in files:
-            if file.file_type == "content":
-                content_file = file
-            elif file.file_type == "attachment":
-                attachments.append({
-                    "id": file.id,
-                    "filename": file.filename,
-                    "size": file.size
-                })
-        
-        # Get tags
-        from app.models import NoteTag
-        tags = session.exec(
-            select(NoteTag).where(NoteTag.note_id == note.id)
-        ).all()
-        tag_list = [tag.tag for tag in tags]
-        
-        result.append({
-            "id": note.id,
-            "title": note.title,
-            "subject": note.subject,
-            "visibility": note.visibility,
-            "content_file_id": content_file.id if content_file else None,
-            "attachments": attachments,
-            "tags": tag_list,
-            "created_at": note.created_at.isoformat(),
-            "updated_at": note.updated_at.isoformat(),
-        })
+    result = [_serialize_note(note) for note in notes]
     
     return {"notes": result, "total": len(result)}
 
@@ -567,7 +731,9 @@ def get_note(
     """
     user = _current_user(request, session)
     
-    note = session.get(NoteModel, note_id)
+    note = session.get(
+        NoteModel, note_id, options=[selectinload(NoteModel.files), selectinload(NoteModel.tags)]
+    )
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
@@ -575,41 +741,7 @@ def get_note(
     if note.user_id != user.id and note.visibility != "public":
         raise HTTPException(status_code=403, detail="Not authorized to view this note")
     
-    # Get associated files
-    files = session.exec(
-        select(FileModel).where(FileModel.note_id == note.id)
-    ).all()
-    
-    content_file = None
-    attachments = []
-    for file in files:
-        if file.file_type == "content":
-            content_file = file
-        elif file.file_type == "attachment":
-            attachments.append({
-                "id": file.id,
-                "filename": file.filename,
-                "size": file.size
-            })
-    
-    # Get tags
-    from app.models import NoteTag
-    tags = session.exec(
-        select(NoteTag).where(NoteTag.note_id == note.id)
-    ).all()
-    tag_list = [tag.tag for tag in tags]
-    
-    return {
-        "id": note.id,
-        "title": note.title,
-        "subject": note.subject,
-        "visibility": note.visibility,
-        "content_file_id": content_file.id if content_file else None,
-        "attachments": attachments,
-        "tags": tag_list,
-        "created_at": note.created_at.isoformat(),
-        "updated_at": note.updated_at.isoformat(),
-    }
+    return _serialize_note(note)
 
 
 @router.delete("/{note_id}")
@@ -635,10 +767,9 @@ def delete_note(
     if note.visibility == "public":
         try:
             from app.rag_engine import remove_note_from_index
-            remove_note_from_index(note.id)
-            print(f"Removed note {note.id} from RAG index")
+            _queue_rag_job("remove", note.id, remove_note_from_index, note.id)
         except Exception as e:
-            print(f"Warning: Failed to remove note {note.id} from index: {e}")
+            logger.warning("Failed to remove note %d from index: %s", note.id, e)
     
     # Get all associated files
     files = session.exec(
@@ -692,168 +823,184 @@ def update_note(
     if note.user_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this note")
     
-    lock = _user_locks.setdefault(user.id, threading.Lock())
-    
-    with lock:
-        try:
-            # Update note fields
-            if title is not None:
-                note.title = title
+    # New files on disk for this request, removed again if it doesn't commit
+    written_paths: list[Path] = []
+    # Files superseded by this update, removed only once it has committed
+    replaced_paths: list[Path] = []
+    try:
+        # One timestamp for the note update and every file row it adds
+        now = datetime.utcnow()
+        now_iso = now.isoformat() + "Z"
+        
+        # One entropy draw covers the replacement content file and every new attachment
+        nonces = iter(_gcm_nonces((content is not None) + len(new_attachments)))
+        tokens = iter(_stored_tokens((content is not None) + len(new_attachments)))
+        
+        # Update note fields
+        if title is not None:
+            note.title = title
+        
+        if subject is not None:
+            note.subject = subject
+        
+        if visibility is not None and visibility.lower() in {"private", "public"}:
+            note.visibility = visibility.lower()
+        
+        note.updated_at = now
+        
+        # Update content if provided
+        if content is not None:
+            # Replace the old content file; its bytes stay on disk until the commit
+            # succeeds, so a rollback leaves the restored row pointing at a real file
+            old_content = session.exec(
+                select(FileModel).where(
+                    FileModel.note_id == note.id,
+                    FileModel.file_type == "content"
+                )
+            ).first()
+            
+            if old_content:
+                replaced_paths.append(UPLOAD_DIR / old_content.filepath)
+                session.delete(old_content)
+            
+            # Create new content file
+            content_bytes = content.encode('utf-8')
             
-            if subject is not None:
-                note.subject = subject
+            stored_token = next(tokens)
+            stored_name = f"{stored_token}.md"
             
-            if visibility is not None and visibility.lower() in {"private", "public"}:
-                note.visibility = visibility.lower()
+            final_path, size, content_type, checksum, compressed, encrypted, nonce, tag = _atomic_write_bytes(
+                content_bytes, UPLOAD_DIR, stored_name, nonce=next(nonces)
+            )
+            written_paths.append(final_path)
             
-            note.updated_at = datetime.utcnow()
+            content_file = FileModel(
+                filename=f"{note.title}.md",
+                filepath=stored_name,
+                file_type="content",
+                owner_id=user.id,
+                note_id=note.id,
+                size=size,
+                checksum_sha256=checksum,
+                is_compressed=bool(compressed),
+                is_encrypted=bool(encrypted),
+                encryption_nonce_hex=(nonce.hex() if nonce else None),
+                encryption_tag_hex=(tag.hex() if tag else None),
+                uploaded_at=now_iso,
+            )
+            session.add(content_file)
+        
+        # Add new attachments (validated up front, written concurrently)
+        pending = []
+        for attachment in new_attachments:
+            if not attachment.filename:
+                continue
             
-            # Update content if provided
-            if content is not None:
-                # Find and delete old content file
-                old_content = session.exec(
+            ext = _validate_extension(attachment.filename)
+            attach_token = next(tokens)
+            pending.append((attachment, f"{attach_token}{ext}", next(nonces)))
+        
+        for (attachment, attach_stored_name, _), written in zip(pending, _write_attachments(pending)):
+            attach_path, attach_size, attach_type, attach_checksum, attach_compressed, attach_encrypted, attach_nonce, attach_tag = written
+            written_paths.append(attach_path)
+            
+            attachment_file = FileModel(
+                filename=attachment.filename,
+                filepath=attach_stored_name,
+                file_type="attachment",
+                owner_id=user.id,
+                note_id=note.id,
+                size=attach_size,
+                checksum_sha256=attach_checksum,
+                is_compressed=bool(attach_compressed),
+                is_encrypted=bool(attach_encrypted),
+                encryption_nonce_hex=(attach_nonce.hex() if attach_nonce else None),
+                encryption_tag_hex=(attach_tag.hex() if attach_tag else None),
+                uploaded_at=now_iso,
+            )
+            session.add(attachment_file)
+        
+        # File I/O happens above, outside the lock; the stripe is held only for the quota
+        # re-check and the commit. The aggregate autoflushes this update's rows, so the
+        # total already includes the new files and excludes a replaced content file
+        with _user_lock(user.id):
+            if _user_storage_bytes(session, user.id) > MAX_USER_TOTAL_BYTES:
+                raise HTTPException(status_code=403, detail="Storage quota exceeded")
+            session.commit()
+        written_paths.clear()  # committed: the rows own these files now
+        _remove_files(replaced_paths)
+        session.refresh(note)
+        
+        # Handle RAG indexing based on visibility changes
+        if note.visibility == "public":
+            # Index or re-index the note
+            try:
+                from app.rag_engine import index_note as rag_index_note
+                
+                # Get content file
+                content_file_db = session.exec(
                     select(FileModel).where(
                         FileModel.note_id == note.id,
                         FileModel.file_type == "content"
                     )
                 ).first()
                 
-                if old_content:
-                    try:
-                        full_path = UPLOAD_DIR / old_content.filepath
-                        if os.path.exists(full_path):
-                            os.remove(full_path)
-                    except OSError:
-                        pass
-                    session.delete(old_content)
-                
-                # Create new content file
-                content_bytes = content.encode('utf-8')
-                content_stream = io.BytesIO(content_bytes)
-                
-                stored_token = secrets.token_urlsafe(16)
-                stored_name = f"{stored_token}.md"
-                
-                final_path, size, content_type, checksum, compressed, encrypted, nonce, tag = _atomic_write(
-                    content_stream, UPLOAD_DIR, stored_name
-                )
-                
-                content_file = FileModel(
-                    filename=f"{note.title}.md",
-                    filepath=stored_name,
-                    file_type="content",
-                    owner_id=user.id,
-                    note_id=note.id,
-                    size=size,
-                    checksum_sha256=checksum,
-                    is_compressed=bool(compressed),
-                    is_encrypted=bool(encrypted),
-                    encryption_nonce_hex=(nonce.hex() if nonce else None),
-                    encryption_tag_hex=(tag.hex() if tag else None),
-                    uploaded_at=datetime.utcnow().isoformat() + "Z",
-                )
-                session.add(content_file)
-            
-            # Add new attachments
-            for attachment in new_attachments:
-                if not attachment.filename:
-                    continue
-                
-                ext = _validate_extension(attachment.filename)
-                attach_token = secrets.token_urlsafe(16)
-                attach_stored_name = f"{attach_token}{ext}"
+                # Get attachments
+                attachments = session.exec(
+                    select(FileModel).where(
+                        FileModel.note_id == note.id,
+                        FileModel.file_type == "attachment"
+                    )
+                ).all()
                 
-                attach_path, attach_size, attach_type, attach_checksum, attach_compressed, attach_encrypted, attach_nonce, attach_tag = _atomic_write(
-                    attachment.file, UPLOAD_DIR, attach_stored_name
-                )
+                attachment_info = []
+                for att in attachments:
+                    attachment_info.append({
+                        'path': UPLOAD_DIR / att.filepath,
+                        'extension': os.path.splitext(att.filename)[1],
+                        'encrypted': att.is_encrypted,
+                        'compressed': att.is_compressed,
+                        'nonce_hex': att.encryption_nonce_hex,
+                        'filename': att.filename
+                    })
                 
-                attachment_file = FileModel(
-                    filename=attachment.filename,
-                    filepath=attach_stored_name,
-                    file_type="attachment",
-                    owner_id=user.id,
-                    note_id=note.id,
-                    size=attach_size,
-                    checksum_sha256=attach_checksum,
-                    is_compressed=bool(attach_compressed),
-                    is_encrypted=bool(attach_encrypted),
-                    encryption_nonce_hex=(attach_nonce.hex() if attach_nonce else None),
-                    encryption_tag_hex=(attach_tag.hex() if attach_tag else None),
-                    uploaded_at=datetime.utcnow().isoformat() + "Z",
-                )
-                session.add(attachment_file)
-            
-            session.commit()
-            session.refresh(note)
-            
-            # Handle RAG indexing based on visibility changes
-            if note.visibility == "public":
-                # Index or re-index the note
-                try:
-                    from app.rag_engine import index_note as rag_index_note
-                    
-                    # Get content file
-                    content_file_db = session.exec(
-                        select(FileModel).where(
-                            FileModel.note_id == note.id,
-                            FileModel.file_type == "content"
-                        )
-                    ).first()
-                    
-                    # Get attachments
-                    attachments = session.exec(
-                        select(FileModel).where(
-                            FileModel.note_id == note.id,
-                            FileModel.file_type == "attachment"
-                        )
-                    ).all()
-                    
-                    attachment_info = []
-                    for att in attachments:
-                        attachment_info.append({
-                            'path': UPLOAD_DIR / att.filepath,
-                            'extension': os.path.splitext(att.filename)[1],
-                            'encrypted': att.is_encrypted,
-                            'compressed': att.is_compressed,
-                            'nonce_hex': att.encryption_nonce_hex,
-                            'filename': att.filename
-                        })
-                    
-                    if content_file_db:
-                        rag_index_note(
-                            note_id=note.id,
-                            note_title=note.title,
-                            owner_id=user.id,
-                            content_file_path=UPLOAD_DIR / content_file_db.filepath,
-                            content_file_encrypted=content_file_db.is_encrypted,
-                            content_file_compressed=content_file_db.is_compressed,
-                            content_file_nonce_hex=content_file_db.encryption_nonce_hex,
-                            attachment_files=attachment_info if attachment_info else None
-                        )
-                        print(f"Successfully indexed/updated public note {note.id} in RAG")
-                except Exception as e:
-                    print(f"Warning: Failed to index note {note.id}: {e}")
-            else:
-                # If note is now private, remove from index
-                try:
-                    from app.rag_engine import remove_note_from_index
-                    remove_note_from_index(note.id)
-                    print(f"Removed note {note.id} from RAG index (now private)")
-                except Exception as e:
-                    print(f"Warning: Failed to remove note {note.id} from index: {e}")
-            
-            return {
-                "id": note.id,
-                "title": note.title,
-                "subject": note.subject,
-                "visibility": note.visibility,
-                "updated_at": note.updated_at.isoformat(),
-                "message": "Note updated successfully"
-            }
-            
-        except HTTPException:
-            session.rollback()
-            raise
-        except Exception as e:
-            session.rollback()
-            raise HTTPException(status_code=500, detail=f"Failed to update note: {str(e)}")
+                if content_file_db:
+                    _queue_rag_job(
+                        "index", note.id,
+                        rag_index_note,
+                        note_id=note.id,
+                        note_title=note.title,
+                        owner_id=user.id,
+                        content_file_path=UPLOAD_DIR / content_file_db.filepath,
+                        content_file_encrypted=content_file_db.is_encrypted,
+                        content_file_compressed=content_file_db.is_compressed,
+                        content_file_nonce_hex=content_file_db.encryption_nonce_hex,
+                        attachment_files=attachment_info if attachment_info else None
+                    )
+            except Exception as e:
+                logger.warning("Failed to index note %d: %s", note.id, e)
+        else:
+            # If note is now private, remove from index
+            try:
+                from app.rag_engine import remove_note_from_index
+                _queue_rag_job("remove", note.id, remove_note_from_index, note.id)
+            except Exception as e:
+                logger.warning("Failed to remove note %d from index: %s", note.id, e)
+        
+        return {
+            "id": note.id,
+            "title": note.title,
+            "subject": note.subject,
+            "visibility": note.visibility,
+            "updated_at": note.updated_at.isoformat(),
+            "message": "Note updated successfully"
+        }
+        
+    except HTTPException:
+        session.rollback()
+        _remove_files(written_paths)
+        raise
+    except Exception as e:
+        session.rollback()
+        _remove_files(written_paths)
+        raise HTTPException(status_code=500, detail=f"Failed to update note: {str(e)}")
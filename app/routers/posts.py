@@ -1,12 +1,14 @@
 """Posts (Q&A) router for community questions and answers."""
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
+from sqlalchemy import func, update
 from typing import List, Optional
 from datetime import datetime, timezone
-import json
+from functools import lru_cache
 
+from app import json_utils
 from app.db import get_session
-from app.models import Post, PostCreate, PostRead, User, Comment, CommentCreate, CommentRead
+from app.models import Post, PostCreate, PostRead, PostLike, User, Comment, CommentCreate, CommentRead, CommentLike
 from app.security import get_current_user
 
 router = APIRouter()
@@ -16,7 +18,62 @@ def utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
 
+@lru_cache(maxsize=4096)
+def _parse_tags(raw: str) -> tuple:
+    return tuple(json_utils.loads(raw))
+
+
+def post_tags(post: Post) -> List[str]:
+    # Tag sets repeat heavily across posts, so decode each distinct JSON string once per process
+    return list(_parse_tags(post.tags)) if post.tags else []
+
+
+def comment_count(session: Session, post_id: int) -> int:
+    return session.exec(
+        select(func.count()).select_from(Comment).where(Comment.post_id == post_id)
+    ).one()
+
+
+def comment_counts(session: Session, post_ids: List[int]) -> dict:
+    """Comment totals for several posts in one grouped query; posts without comments are absent."""
+    if not post_ids:
+        return {}
+    rows = session.exec(
+        select(Comment.post_id, func.count(Comment.id))
+        .where(Comment.post_id.in_(post_ids))
+        .group_by(Comment.post_id)
+    ).all()
+    return dict(rows)
+
+
+def liked_post_ids(session: Session, user: Optional[User], post_ids: List[int]) -> set:
+    if not user or not post_ids:
+        return set()
+    return set(session.exec(
+        select(PostLike.post_id).where(PostLike.user_id == user.id, PostLike.post_id.in_(post_ids))
+    ).all())
+
+
+def liked_comment_ids(session: Session, user: Optional[User], comment_ids: List[int]) -> set:
+    if not user or not comment_ids:
+        return set()
+    return set(session.exec(
+        select(CommentLike.comment_id).where(CommentLike.user_id == user.id, CommentLike.comment_id.in_(comment_ids))
+    ).all())
+
+
+def _too_long_unstripped(value: str, limit: int) -> bool:
+    # Oversized input with no surrounding whitespace can't shrink under strip(): reject it
+    # without copying. Anything else goes through strip() so the accepted set is unchanged.
+    return len(value) > limit and not (value[:1].isspace() or value[-1:].isspace())
+
+
 def validate_post_title(title: str) -> str:
+    if _too_long_unstripped(title, 500):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Question title cannot exceed 500 characters"
+        )
     title = title.strip()
     if not title:
         raise HTTPException(
@@ -37,6 +94,11 @@ def validate_post_title(title: str) -> str:
 
 
 def validate_post_content(content: str) -> str:
+    if _too_long_unstripped(content, 50000):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Question details cannot exceed 50000 characters"
+        )
     content = content.strip()
     if not content:
         raise HTTPException(
@@ -56,6 +118,9 @@ def validate_post_content(content: str) -> str:
     return content
 
 
+_TAG_SPACES = str.maketrans(" ", "-")
+
+
 def validate_tags(tags: List[str]) -> List[str]:
     if not tags:
         raise HTTPException(
@@ -69,8 +134,9 @@ def validate_tags(tags: List[str]) -> List[str]:
         )
     
     normalized_tags = []
+    seen = set()
     for tag in tags:
-        tag = tag.strip().lower().replace(' ', '-')
+        tag = tag.strip().translate(_TAG_SPACES).lower()
         if not tag:
             continue
         if len(tag) > 50:
@@ -78,7 +144,8 @@ def validate_tags(tags: List[str]) -> List[str]:
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Each tag cannot exceed 50 characters"
             )
-        if tag not in normalized_tags:
+        if tag not in seen:
+            seen.add(tag)
             normalized_tags.append(tag)
     
     if not normalized_tags:
@@ -102,28 +169,30 @@ def create_post(
     tags = validate_tags(post_data.tags)
     
     author_name = current_user.name
+    now = utcnow()
     
     post = Post(
         title=title,
         body=content,
         author_id=current_user.id,
         author_name=author_name,
-        tags=json.dumps(tags),
-        created_at=utcnow(),
-        updated_at=utcnow()
+        tags=json_utils.dumps(tags),
+        created_at=now,
+        updated_at=now
     )
     
     session.add(post)
-    session.commit()
-    session.refresh(post)
+    session.flush()  # assigns the id; every other field is set client-side, so no refresh is needed
     
-    return PostRead(
+    # Responses skip construction-time validation: every value comes from typed columns, and
+    # FastAPI still checks the instance against response_model before serializing it.
+    response = PostRead.model_construct(
         id=post.id,
         title=post.title,
         body=post.body,
         author_id=post.author_id,
         author_name=post.author_name,
-        tags=json.loads(post.tags),
+        tags=tags,
         views=post.views,
         likes=post.likes,
         shares=post.shares,
@@ -132,6 +201,8 @@ def create_post(
         created_at=post.created_at,
         updated_at=post.updated_at
     )
+    session.commit()
+    return response
 
 
 @router.get("", response_model=List[PostRead])
@@ -149,24 +220,24 @@ def get_posts(
     
     statement = statement.offset(skip).limit(limit)
     posts = session.exec(statement).all()
+    post_ids = [post.id for post in posts]
+    counts = comment_counts(session, post_ids)
+    liked_ids = liked_post_ids(session, current_user, post_ids)
     
     result = []
     for post in posts:
-        liked_by = json.loads(post.liked_by) if post.liked_by else []
-        comment_count = session.exec(select(Comment).where(Comment.post_id == post.id)).all()
-        
-        result.append(PostRead(
+        result.append(PostRead.model_construct(
             id=post.id,
             title=post.title,
             body=post.body,
             author_id=post.author_id,
             author_name=post.author_name,
-            tags=json.loads(post.tags) if post.tags else [],
+            tags=post_tags(post),
             views=post.views,
             likes=post.likes,
             shares=post.shares,
-            liked_by_user=current_user.id in liked_by if current_user else False,
-            comment_count=len(comment_count),
+            liked_by_user=post.id in liked_ids,
+            comment_count=counts.get(post.id, 0),
             created_at=post.created_at,
             updated_at=post.updated_at
         ))
@@ -180,36 +251,36 @@ def get_post(
     session: Session = Depends(get_session),
     current_user: Optional[User] = Depends(get_current_user)
 ):
-    post = session.get(Post, post_id)
-    if not post:
+    # Atomic increment in the database: concurrent viewers can't lose counts
+    views = session.execute(
+        update(Post).where(Post.id == post_id).values(views=Post.views + 1).returning(Post.views)
+    ).scalar_one_or_none()
+    if views is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found"
         )
     
-    post.views += 1
-    session.add(post)
-    session.commit()
-    session.refresh(post)
-    
-    liked_by = json.loads(post.liked_by) if post.liked_by else []
-    comment_count = session.exec(select(Comment).where(Comment.post_id == post.id)).all()
+    post = session.get(Post, post_id)
+    liked = bool(current_user) and session.get(PostLike, (post.id, current_user.id)) is not None
     
-    return PostRead(
+    response = PostRead.model_construct(
         id=post.id,
         title=post.title,
         body=post.body,
         author_id=post.author_id,
         author_name=post.author_name,
-        tags=json.loads(post.tags) if post.tags else [],
-        views=post.views,
+        tags=post_tags(post),
+        views=views,
         likes=post.likes,
         shares=post.shares,
-        liked_by_user=current_user.id in liked_by if current_user else False,
-        comment_count=len(comment_count),
+        liked_by_user=liked,
+        comment_count=comment_count(session, post.id),
         created_at=post.created_at,
         updated_at=post.updated_at
     )
+    session.commit()
+    return response
 
 
 @router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -249,37 +320,35 @@ def like_post(
             detail="Post not found"
         )
     
-    liked_by = json.loads(post.liked_by) if post.liked_by else []
+    like = session.get(PostLike, (post.id, current_user.id))
     
-    if current_user.id in liked_by:
-        liked_by.remove(current_user.id)
+    if like:
+        session.delete(like)
         post.likes = max(0, post.likes - 1)
     else:
-        liked_by.append(current_user.id)
+        session.add(PostLike(post_id=post.id, user_id=current_user.id))
         post.likes += 1
     
-    post.liked_by = json.dumps(liked_by)
     session.add(post)
-    session.commit()
-    session.refresh(post)
+    session.flush()
     
-    comment_count = session.exec(select(Comment).where(Comment.post_id == post.id)).all()
-    
-    return PostRead(
+    response = PostRead.model_construct(
         id=post.id,
         title=post.title,
         body=post.body,
         author_id=post.author_id,
         author_name=post.author_name,
-        tags=json.loads(post.tags) if post.tags else [],
+        tags=post_tags(post),
         views=post.views,
         likes=post.likes,
         shares=post.shares,
-        liked_by_user=current_user.id in liked_by,
-        comment_count=len(comment_count),
+        liked_by_user=like is None,
+        comment_count=comment_count(session, post.id),
         created_at=post.created_at,
         updated_at=post.updated_at
     )
+    session.commit()
+    return response
 
 
 @router.post("/{post_id}/share")
@@ -288,18 +357,17 @@ def share_post(
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    post = session.get(Post, post_id)
-    if not post:
+    shares = session.execute(
+        update(Post).where(Post.id == post_id).values(shares=Post.shares + 1).returning(Post.shares)
+    ).scalar_one_or_none()
+    if shares is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found"
         )
-    
-    post.shares += 1
-    session.add(post)
     session.commit()
     
-    return {"message": "Post shared successfully", "shares": post.shares}
+    return {"message": "Post shared successfully", "shares": shares}
 
 
 @router.get("/{post_id}/comments", response_model=List[CommentRead])
@@ -312,17 +380,18 @@ def get_comments(
         select(Comment).where(Comment.post_id == post_id).order_by(Comment.likes.desc(), Comment.created_at.desc())
     ).all()
     
+    liked_ids = liked_comment_ids(session, current_user, [comment.id for comment in comments])
+    
     result = []
     for comment in comments:
-        liked_by = json.loads(comment.liked_by) if comment.liked_by else []
-        result.append(CommentRead(
+        result.append(CommentRead.model_construct(
             id=comment.id,
             post_id=comment.post_id,
             user_id=comment.user_id,
             user_name=comment.user_name,
             content=comment.content,
             likes=comment.likes,
-            liked_by_user=current_user.id in liked_by if current_user else False,
+            liked_by_user=comment.id in liked_ids,
             created_at=comment.created_at,
             updated_at=comment.updated_at
         ))
@@ -357,6 +426,7 @@ def create_comment(
             detail="Comment cannot exceed 5000 characters"
         )
     
+    now = utcnow()
     comment = Comment(
         post_id=post_id,
         user_id=current_user.id,
@@ -364,15 +434,14 @@ def create_comment(
         content=content,
         likes=0,
         liked_by="[]",
-        created_at=utcnow(),
-        updated_at=utcnow()
+        created_at=now,
+        updated_at=now
     )
     
     session.add(comment)
-    session.commit()
-    session.refresh(comment)
+    session.flush()  # assigns the id; every other field is set client-side, so no refresh is needed
     
-    return CommentRead(
+    response = CommentRead.model_construct(
         id=comment.id,
         post_id=comment.post_id,
         user_id=comment.user_id,
@@ -383,6 +452,8 @@ def create_comment(
         created_at=comment.created_at,
         updated_at=comment.updated_at
     )
+    session.commit()
+    return response
 
 
 @router.delete("/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -422,28 +493,28 @@ def like_comment(
             detail="Comment not found"
         )
     
-    liked_by = json.loads(comment.liked_by) if comment.liked_by else []
+    like = session.get(CommentLike, (comment.id, current_user.id))
     
-    if current_user.id in liked_by:
-        liked_by.remove(current_user.id)
+    if like:
+        session.delete(like)
         comment.likes = max(0, comment.likes - 1)
     else:
-        liked_by.append(current_user.id)
+        session.add(CommentLike(comment_id=comment.id, user_id=current_user.id))
         comment.likes += 1
     
-    comment.liked_by = json.dumps(liked_by)
     session.add(comment)
-    session.commit()
-    session.refresh(comment)
+    session.flush()
     
-    return CommentRead(
+    response = CommentRead.model_construct(
         id=comment.id,
         post_id=comment.post_id,
         user_id=comment.user_id,
         user_name=comment.user_name,
         content=comment.content,
         likes=comment.likes,
-        liked_by_user=current_user.id in liked_by,
+        liked_by_user=like is None,
         created_at=comment.created_at,
         updated_at=comment.updated_at
     )
+    session.commit()
+    return response
@@ -2,6 +2,7 @@
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlmodel import Session, select
+from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
 from app.db import get_session
@@ -18,19 +19,35 @@ router = APIRouter()
 
 # Reuse the central JWT-based auth from users router to keep a single source of truth.
 try:
-    from app.routers.users import get_user_from_token as _jwt_current_user  # type: ignore
+    from app.routers.users import get_user_id_from_token as _jwt_user_id  # type: ignore
 except Exception:  # Fallback (should not normally happen)
-    _jwt_current_user = None  # type: ignore
+    _jwt_user_id = None  # type: ignore
 
-def _current_user(request: Request, session: Session) -> User:
-    if _jwt_current_user is None:
+def _current_user_id(request: Request) -> int:
+    # Token-only check for routes that just require a signed-in caller: no User row is loaded
+    if _jwt_user_id is None:
         raise HTTPException(status_code=500, detail="Auth subsystem unavailable")
-    return _jwt_current_user(request, session)
+    return _jwt_user_id(request)
+
+def _own_profile(request: Request, session: Session) -> StudentProfile:
+    # Resolve the caller's user and profile rows in one round trip instead of two
+    user_id = _current_user_id(request)
+    row = session.exec(
+        select(User, StudentProfile)
+        .outerjoin(StudentProfile, StudentProfile.user_id == User.id)
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    _, profile = row
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
 
 # Create profile endpoint is now restricted because profile is auto-created at registration.
 @router.post("/", response_model=StudentProfileRead, deprecated=True)
 def create_profile(_: StudentProfileCreate, request: Request, session: Session = Depends(get_session)):
-    _ = _current_user(request, session)
+    _ = _current_user_id(request)
     raise HTTPException(status_code=409, detail="Profile is created automatically")
 
 @router.get("/", response_model=List[StudentProfileRead])
@@ -42,13 +59,14 @@ def list_profiles(
     offset: int = Query(0, ge=0),
     only_public: bool = Query(True, description="Return only public profiles")
 ):
-    _ = _current_user(request, session)  # Require auth
+    _ = _current_user_id(request)  # Require auth
     stmt = select(StudentProfile)
     if only_public:
         stmt = stmt.where(StudentProfile.is_public == True)  # noqa: E712
     if q:
         like = f"%{q.lower()}%"
-        # Case-insensitive search using lower() where supported; fallback to ILIKE like pattern
+        # Case-insensitive substring search. On Postgres each '%term%' ILIKE is served by the
+        # trigram indexes from migrations/006 (the planner ORs the bitmap index scans).
         stmt = stmt.where(
             (StudentProfile.name.ilike(like)) |
             (StudentProfile.username.ilike(like)) |
@@ -60,10 +78,7 @@ def list_profiles(
 
 @router.get("/me", response_model=StudentProfileRead)
 def get_own_profile(request: Request, session: Session = Depends(get_session)):
-    user = _current_user(request, session)
-    profile = session.exec(select(StudentProfile).where(StudentProfile.user_id == user.id)).first()
-    if not profile:
-        raise HTTPException(status_code=404, detail="Profile not found")
+    profile = _own_profile(request, session)
     return profile
 
 @router.patch("/me", response_model=StudentProfileRead)
@@ -72,23 +87,15 @@ def update_own_profile(
     request: Request,
     session: Session = Depends(get_session)
 ):
-    user = _current_user(request, session)
-    profile = session.exec(select(StudentProfile).where(StudentProfile.user_id == user.id)).first()
-    if not profile:
-        raise HTTPException(status_code=404, detail="Profile not found")
+    profile = _own_profile(request, session)
     data = payload.model_dump(exclude_unset=True)
     # Enforce username rules & normalization
     if 'username' in data and data['username'] is not None:
         uname = data['username'].strip()
         if uname:
             validate_username(uname)
-            uname_norm = uname.lower()
-            if uname_norm != profile.username:
-                # Check uniqueness manually (DB constraint will also enforce)
-                existing = session.exec(select(StudentProfile).where(StudentProfile.username == uname_norm)).first()
-                if existing and existing.id != profile.id:
-                    raise HTTPException(status_code=400, detail="Username already taken")
-            data['username'] = uname_norm
+            # Uniqueness is enforced by the unique index on username (see IntegrityError below)
+            data['username'] = uname.lower()
         else:
             data['username'] = None
     # Restrict modification of university (system-derived)
@@ -105,6 +112,9 @@ def update_own_profile(
         session.commit()
     except IntegrityError as e:
         session.rollback()
+        if data.get('username'):
+            # username is the only unique column a profile update can touch
+            raise HTTPException(status_code=400, detail="Username already taken") from e
         raise HTTPException(status_code=400, detail="Constraint violation updating profile") from e
     session.refresh(profile)
     return profile
@@ -114,26 +124,31 @@ def delete_own_profile(
     request: Request,
     session: Session = Depends(get_session)
 ):
-    user = _current_user(request, session)
-    profile = session.exec(select(StudentProfile).where(StudentProfile.user_id == user.id)).first()
-    if not profile:
-        raise HTTPException(status_code=404, detail="Profile not found")
+    user_id = _current_user_id(request)
     # Soft delete approach: mark non-public & scrub PII fields rather than row removal (future referential integrity)
-    profile.is_public = False
-    profile.bio = None
-    profile.username = None
-    profile.specialty = None
-    profile.year = None
-    profile.avatar_url = None
-    profile.name = None
-    profile.updated_at = datetime.now(timezone.utc)
-    session.add(profile)
+    scrubbed = session.execute(
+        update(StudentProfile)
+        .where(StudentProfile.user_id == user_id)
+        .values(
+            is_public=False,
+            bio=None,
+            username=None,
+            specialty=None,
+            year=None,
+            avatar_url=None,
+            name=None,
+            updated_at=datetime.now(timezone.utc),
+        )
+        .returning(StudentProfile.id)
+    ).first()
+    if scrubbed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
     session.commit()
     return None
 
 @router.get("/{profile_id}", response_model=StudentProfileRead)
 def get_profile(profile_id: int, request: Request, session: Session = Depends(get_session)):
-    _ = _current_user(request, session)
+    _ = _current_user_id(request)
     profile = session.get(StudentProfile, profile_id)
     if not profile or (not profile.is_public):
         raise HTTPException(status_code=404, detail="Profile not found")
@@ -1,30 +1,76 @@
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any
 from fastapi import APIRouter, HTTPException, Query
 
 from app import rag_engine
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# UI dashboards poll /status; serve a recent snapshot instead of querying Chroma each time
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("RAG_STATUS_CACHE_SECONDS", "5"))
+_status_cache: Dict[str, Any] = {"at": 0.0, "value": None}
 
-@router.post("/index")
-def trigger_index(clear: Optional[bool] = Query(False), folder: Optional[str] = Query(None)) -> Dict[str, Any]:
-    """Trigger indexing. If `folder` is provided, index that folder only.
-    Use `clear=true` to clear existing documents for that folder(s).
-    """
+
+def _invalidate_status() -> None:
+    _status_cache["value"] = None
+
+
+# Full re-indexing can embed thousands of chunks; run it off the request path, one job at a time
+_index_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-reindex")
+MAX_TRACKED_INDEX_JOBS = 100
+# job_id -> {"status": queued|running|done|failed, "folder", "clear", "result"?, "error"?}
+_index_jobs: Dict[str, Dict[str, Any]] = {}
+
+
+def _run_index_job(job_id: str, job: Dict[str, Any], folder: Optional[str], clear: bool) -> None:
+    job["status"] = "running"
     try:
         if folder:
-            count = rag_engine.index_folder(folder, clear_existing=bool(clear))
-            return {"indexed_chunks": count, "folder": folder}
+            count = rag_engine.index_folder(folder, clear_existing=clear)
+            job["result"] = {"indexed_chunks": count, "folder": folder}
         else:
-            results = rag_engine.index_all_folders(clear_existing=bool(clear))
-            return {"results": results}
+            job["result"] = {"results": rag_engine.index_all_folders(clear_existing=clear)}
+        job["status"] = "done"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.warning("RAG index job %s failed: %s", job_id, e)
+        job.update(status="failed", error=str(e))
+    finally:
+        _invalidate_status()
+
+
+@router.post("/index", status_code=202)
+def trigger_index(clear: Optional[bool] = Query(False), folder: Optional[str] = Query(None)) -> Dict[str, Any]:
+    """Queue indexing and return a job id to poll via GET /index/{job_id}.
+    If `folder` is provided, index that folder only.
+    Use `clear=true` to clear existing documents for that folder(s).
+    """
+    job_id = uuid.uuid4().hex
+    job = _index_jobs[job_id] = {"status": "queued", "folder": folder, "clear": bool(clear)}
+    while len(_index_jobs) > MAX_TRACKED_INDEX_JOBS:
+        _index_jobs.pop(next(iter(_index_jobs)))  # forget the oldest job
+    _index_worker.submit(_run_index_job, job_id, job, folder, bool(clear))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/index/{job_id}")
+def index_job_status(job_id: str) -> Dict[str, Any]:
+    job = _index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Index job not found")
+    return {"job_id": job_id, **job}
 
 
 @router.get("/status")
 def rag_status() -> Dict[str, Any]:
     """Return simple RAG index status: collection count and tracked files."""
+    cached = _status_cache["value"]
+    if cached is not None and time.monotonic() - _status_cache["at"] < STATUS_CACHE_TTL_SECONDS:
+        return cached
     try:
         collection = rag_engine.get_collection()
         count = 0
@@ -38,9 +84,11 @@ def rag_status() -> Dict[str, Any]:
                 count = 0
 
         file_meta = rag_engine.load_file_metadata()
-        return {
+        status = {
             "collection_count": int(count),
             "tracked_files": len(file_meta),
         }
+        _status_cache.update(at=time.monotonic(), value=status)
+        return status
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
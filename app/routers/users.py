@@ -1,6 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, Request, BackgroundTasks, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Request
+from sqlalchemy import bindparam, func
 from sqlmodel import Session, select
-from app.security import hash_password, verify_password
+from app.security import (
+    ALGORITHM,
+    _SECRET_KEY_BYTES,
+    get_user_from_token,
+    get_user_id_from_token,
+    hash_password,
+    revoke_token,
+    verify_password,
+    verify_and_optionally_rehash,
+)
 from app.db import get_session
 from app.models import (
     User,
@@ -14,58 +24,115 @@ from app.models import (
     MessageResponse,
     EmailVerification,
 )
-from app.validators import validate_username, validate_password, validate_email_domain
+from app.validators import canonical_email, validate_username, validate_password, validate_email_domain, university_for_domain
 from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import hmac
+import logging
 import jwt
 import os
 import secrets
-import string
 from dotenv import load_dotenv
-import time
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 from app.email_utils import send_verification_email
+from app import json_utils
 
 load_dotenv()
-SECRET_KEY = os.getenv("JWT_SECRET", "").strip()
-ALGORITHM = os.getenv("JWT_ALGORITHM", "").strip()
-if not SECRET_KEY or not ALGORITHM:
-    # Fail fast so misconfiguration is caught early
-    raise RuntimeError("JWT_SECRET or JWT_ALGORITHM missing in environment")
+logger = logging.getLogger(__name__)
+# JWT secret/algorithm, the decoded-token cache and get_user_id_from_token/get_user_from_token
+# live in app.security (one cache shared by every router); re-exported here for the routers
+# that import them from this module.
 
 # Token expiration (minutes). Default 4h if not supplied.
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "240"))
 if ACCESS_TOKEN_EXPIRE_MINUTES < 5:
-    print(f"[WARN] ACCESS_TOKEN_EXPIRE_MINUTES is very low: {ACCESS_TOKEN_EXPIRE_MINUTES} minutes")
+    logger.warning("ACCESS_TOKEN_EXPIRE_MINUTES is very low: %d minutes", ACCESS_TOKEN_EXPIRE_MINUTES)
 
 # Basic brute force mitigation config (env-tunable)
 MAX_FAILED_LOGIN_ATTEMPTS = int(os.getenv("MAX_FAILED_LOGIN_ATTEMPTS", "5"))
 ACCOUNT_LOCK_MINUTES = int(os.getenv("ACCOUNT_LOCK_MINUTES", "15"))  # lock duration
 
-# Cache decoded tokens to avoid re-decoding / verifying on every single request.
-# NOTE: This introduces a trade-off: revocations (e.g., user deletion) propagate
-# only after the cache TTL. Keep TTL modest.
-TOKEN_CACHE_TTL_SECONDS = int(os.getenv("JWT_CACHE_TTL_SECONDS", "600"))  # default 10 minutes
-
-# token -> {"user_id": int, "exp": int(epoch seconds), "cached_at": float, "user_obj": User | None}
-_TOKEN_CACHE: Dict[str, Dict[str, Any]] = {}
-
 # Email verification configuration
 # Length of numeric verification code and expiration time (in minutes)
 VERIFICATION_CODE_LENGTH = int(os.getenv("VERIFICATION_CODE_LENGTH", "6"))
 EMAIL_CODE_EXPIRATION_MINUTES = int(os.getenv("EMAIL_CODE_EXPIRATION_MINUTES", "15"))
 
+# Auth cookie attributes (read once; set_auth_cookie runs on every login/register/verify)
+# In production you should set secure=True (HTTPS) and possibly SameSite=Strict depending on CSRF strategy.
+COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() == "true"
+COOKIE_SAMESITE = os.getenv("COOKIE_SAMESITE", "lax").lower()
+if COOKIE_SAMESITE not in {"lax", "strict", "none"}:
+    COOKIE_SAMESITE = "lax"
+# Everything after the value is fixed per process; rendered once instead of via SimpleCookie per call
+_AUTH_COOKIE_ATTRS = (
+    f"; HttpOnly; Max-Age={ACCESS_TOKEN_EXPIRE_MINUTES * 60}; Path=/; SameSite={COOKIE_SAMESITE}"
+    + ("; Secure" if COOKIE_SECURE else "")
+)
+
+# Password/code hashing is CPU-bound (tens of ms and 64 MiB each for Argon2); a pool sized
+# to the cores caps how many run at once, however many auth requests are in flight.
+_hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="pw-hash")
+
+
+# Verified against when the email is unknown, so that path costs one hash like a real login
+# (no timing-based enumeration, and probing unknown emails isn't cheaper than guessing passwords)
+_DUMMY_PASSWORD_HASH = hash_password(secrets.token_urlsafe(18))
+
+# Prebuilt so the hot email lookups (register/login/verify/resend) share one cached compilation
+_USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+# Existence check only: no column hydration or identity-map entry
+_USER_ID_BY_EMAIL = select(User.id).where(User.email == bindparam("email")).limit(1)
+
+
+def _run_hash(fn: Callable[..., Any], *args: Any) -> Any:
+    # Called from the sync auth endpoints (their Session calls block, so they stay on the
+    # request threadpool); only the hash itself is handed to the bounded pool
+    return _hash_executor.submit(fn, *args).result()
+
+
+# SMTP sends take 0.2-2 s; a dedicated worker keeps them out of the request threadpool
+_mail_worker = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mail")
+
+
+def _send_verification_email_logged(recipient: str, code: str, name: str | None) -> None:
+    try:
+        send_verification_email(recipient, code, name)
+    except Exception:
+        # Never surfaces to the client; the user can request a new code via resend-verification
+        logger.exception("Failed to send verification email to %s", recipient)
+
+
+def _queue_verification_email(recipient: str, code: str, name: str | None) -> None:
+    _mail_worker.submit(_send_verification_email_logged, recipient, code, name)
+
+
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+
+# Fixed header for the HS256 fast path, encoded once instead of per token
+_HS256_HEADER_B64 = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
 
 def create_access_token(*, data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    if ALGORITHM == "HS256":
+        # Same compact JWS PyJWT would emit, minus its per-call header/key/algorithm setup
+        to_encode["exp"] = int(expire.timestamp())
+        signing_input = _HS256_HEADER_B64 + b"." + _b64url(json_utils.dumps(to_encode).encode("utf-8"))
+        signature = hmac.new(_SECRET_KEY_BYTES, signing_input, hashlib.sha256).digest()
+        return (signing_input + b"." + _b64url(signature)).decode("ascii")
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SECRET_KEY_BYTES, algorithm=ALGORITHM)
     return encoded_jwt
 
 
 def generate_verification_code(length: int = VERIFICATION_CODE_LENGTH) -> str:
-    alphabet = string.digits
-    return "".join(secrets.choice(alphabet) for _ in range(length))
+    # One CSPRNG draw for the whole code instead of one per digit
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
 
 
 def ensure_aware(dt: datetime) -> datetime:
@@ -75,93 +142,31 @@ def ensure_aware(dt: datetime) -> datetime:
 
 
 def set_auth_cookie(response: Response, token: str) -> None:
-    # In production you should set secure=True (HTTPS) and possibly SameSite=Strict depending on CSRF strategy.
-    secure_flag = os.getenv("COOKIE_SECURE", "false").lower() == "true"
-    same_site = os.getenv("COOKIE_SAMESITE", "lax").lower()
-    if same_site not in {"lax", "strict", "none"}:
-        same_site = "lax"
-    response.set_cookie(
-        key="access_token",
-        value=token,
-        httponly=True,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,  # seconds
-        samesite=same_site,
-        secure=secure_flag,
-        path="/",
-    )
+    # JWTs are base64url segments joined by '.', so the value never needs cookie quoting
+    response.headers.append("set-cookie", f"access_token={token}{_AUTH_COOKIE_ATTRS}")
 
 
 def delete_auth_cookie(response: Response) -> None:
     response.delete_cookie(key="access_token", path="/")
 
 
-def get_user_from_token(request: Request, session: Session) -> User:
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    now = time.time()
-    cache_entry = _TOKEN_CACHE.get(token)
-
-    # Fast path: use cached decoded token info (primitive values only)
-    if cache_entry and (now - cache_entry["cached_at"]) < TOKEN_CACHE_TTL_SECONDS:
-        # Check expiration without re-decoding
-        if now >= cache_entry["exp"]:
-            _TOKEN_CACHE.pop(token, None)
-            raise HTTPException(status_code=401, detail="Token expired")
-        # Always load fresh ORM object from the provided session to avoid DetachedInstanceError
-        user_id = cache_entry.get("user_id")
-        if user_id is None:
-            _TOKEN_CACHE.pop(token, None)
-            raise HTTPException(status_code=401, detail="Invalid token cache entry")
-        user_obj = session.exec(select(User).where(User.id == int(user_id))).first()
-        if not user_obj:
-            _TOKEN_CACHE.pop(token, None)
-            raise HTTPException(status_code=401, detail="User not found")
-        return user_obj
-
-    # Slow path: decode JWT anew
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        exp = payload.get("exp")
-        if user_id is None or exp is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user = session.exec(select(User).where(User.id == int(user_id))).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-
-    # Store / refresh cache with primitive values only (do not store ORM instances)
-    _TOKEN_CACHE[token] = {
-        "user_id": int(user_id),
-        "exp": int(exp),
-        "cached_at": now,
-    }
-    return user
-
 router = APIRouter()
 
 @router.post("/register", response_model=UserRead)
 def register_user(
     user_in: UserCreate,
     response: Response,
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
 ):
-    email = (user_in.email or "").strip().lower()
+    email = canonical_email(user_in.email)
     name = (user_in.name or "").strip()
     password = user_in.password or ""
 
     if not email or not name or not password:
         raise HTTPException(status_code=400, detail="Email, name and password are required")
 
-    existing = session.exec(select(User).where(User.email == email)).first()
-    if existing:
+    existing_id = session.exec(_USER_ID_BY_EMAIL, params={"email": email}).first()
+    if existing_id is not None:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     try:
@@ -171,69 +176,89 @@ def register_user(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    user = User(email=email, name=name, hashed_password=hash_password(password))
+    user = User(email=email, name=name, hashed_password=_run_hash(hash_password, password))
     session.add(user)
     try:
-        session.commit()
+        session.flush()  # INSERT ... RETURNING id; everything below commits once
     except Exception as e:
         session.rollback()
         raise HTTPException(status_code=400, detail="Failed to create user") from e
-    session.refresh(user)
 
-    university = None
-    domain_part = email.split('@', 1)[1] if '@' in email else ''
-    if domain_part:
-        fragments = domain_part.split('.')
-        if len(fragments) >= 2:
-            university = '.'.join(fragments[-2:])
+    university = university_for_domain(email.rsplit('@', 1)[1]) if '@' in email else None
 
     try:
-        profile = StudentProfile(user_id=user.id, university=university, username=name)
-        session.add(profile)
-        session.commit()
+        with session.begin_nested():
+            session.add(StudentProfile(user_id=user.id, university=university, username=name))
     except Exception:
-        session.rollback()  # Non-fatal; continue without profile
+        pass  # Non-fatal (e.g. username taken); savepoint rolled back, continue without profile
 
     # Create initial email verification entry & send code if user not verified yet
+    verification_code = None
     if not user.is_verified:
         verification_code = generate_verification_code()
-        verification_hash = hash_password(verification_code)
-        expires_at = datetime.now(timezone.utc) + timedelta(minutes=EMAIL_CODE_EXPIRATION_MINUTES)
-
-        verification = EmailVerification(
+        now = datetime.now(timezone.utc)
+        session.add(EmailVerification(
             user_id=user.id,
-            code_hash=verification_hash,
-            expires_at=expires_at,
-        )
-        try:
-            session.add(verification)
-            session.commit()
-        except Exception:
-            session.rollback()  # Non-fatal; proceed without email but user remains unverified
-        else:
-            background_tasks.add_task(send_verification_email, user.email, verification_code, user.name)
-
-    token = create_access_token(data={"sub": str(user.id)})
+            code_hash=_run_hash(hash_password, verification_code),
+            expires_at=now + timedelta(minutes=EMAIL_CODE_EXPIRATION_MINUTES),
+            created_at=now,
+        ))
+
+    # Built before commit so the expired instance isn't re-SELECTed for the response
+    result = UserRead.model_validate(user)
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail="Failed to create user") from e
+
+    if verification_code:
+        _queue_verification_email(email, verification_code, name)
+
+    token = create_access_token(data={"sub": str(result.id)})
     set_auth_cookie(response, token)
-    return user
+    return result
 
 @router.post("/login", response_model=UserRead)
 def login_user(login_data: UserLogin, response: Response, session: Session = Depends(get_session)):
-    email = (login_data.email or "").strip().lower()
-    user = session.exec(select(User).where(User.email == email)).first()
+    email = canonical_email(login_data.email)
+    user = session.exec(_USER_BY_EMAIL, params={"email": email}).first()
     # Uniform error to avoid user enumeration
     invalid_error = HTTPException(status_code=401, detail="Invalid email or password")
     now = datetime.now(timezone.utc)
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid email or password")
+    # A locked account answers exactly like an unknown email (same 401, same one hash), so
+    # the lockout can't be used to tell registered addresses apart; even the right password
+    # is refused until locked_until passes
+    if not user or (user.locked_until and ensure_aware(user.locked_until) > now):
+        _run_hash(verify_password, login_data.password, _DUMMY_PASSWORD_HASH)
+        raise invalid_error
     
-    if not verify_password(login_data.password, user.hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid email or password")
+    valid, new_hash = _run_hash(
+        verify_and_optionally_rehash, login_data.password, user.hashed_password
+    )
+    if not valid:
+        user.failed_login_attempts = (user.failed_login_attempts or 0) + 1
+        if user.failed_login_attempts >= MAX_FAILED_LOGIN_ATTEMPTS:
+            user.locked_until = now + timedelta(minutes=ACCOUNT_LOCK_MINUTES)
+            user.failed_login_attempts = 0
+        session.add(user)
+        session.commit()
+        raise invalid_error
+
+    result = UserRead.model_validate(user)
+    if new_hash or user.failed_login_attempts or user.locked_until:
+        if new_hash:
+            # Transparent upgrade of legacy bcrypt (or outdated Argon2) hashes
+            user.hashed_password = new_hash
+        user.failed_login_attempts = 0
+        user.locked_until = None
+        session.add(user)
+        session.commit()
     
-    token = create_access_token(data={"sub": str(user.id)})
+    token = create_access_token(data={"sub": str(result.id)})
     set_auth_cookie(response, token)
-    return user
+    return result
 
 
 @router.post("/verify-email", response_model=UserRead)
@@ -242,7 +267,9 @@ def verify_email(
     response: Response,
     session: Session = Depends(get_session),
 ) -> UserRead:
-    user = session.exec(select(User).where(User.email == payload.email)).first()
+    # Stored emails are canonical (lowercase), so the plain unique index serves this
+    email = canonical_email(payload.email)
+    user = session.exec(_USER_BY_EMAIL, params={"email": email}).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -259,29 +286,31 @@ def verify_email(
     if ensure_aware(verification.expires_at) < datetime.now(timezone.utc):
         raise HTTPException(status_code=400, detail="Verification code expired")
 
-    if not verify_password(payload.code, verification.code_hash):
+    if not _run_hash(verify_password, payload.code, verification.code_hash):
         raise HTTPException(status_code=400, detail="Invalid verification code")
 
     user.is_verified = True
 
     session.add(user)
     session.delete(verification)
+    # Serialize before commit expires the instance, so no refresh SELECT is needed afterwards
+    result = UserRead.model_validate(user)
     session.commit()
-    session.refresh(user)
 
-    token = create_access_token(data={"sub": str(user.id)})
+    token = create_access_token(data={"sub": str(result.id)})
     set_auth_cookie(response, token)
 
-    return user
+    return result
 
 
 @router.post("/resend-verification", response_model=MessageResponse)
 def resend_verification(
     payload: EmailResendRequest,
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
 ) -> MessageResponse:
-    user = session.exec(select(User).where(User.email == payload.email)).first()
+    # Stored emails are canonical (lowercase), so the plain unique index serves this
+    email = canonical_email(payload.email)
+    user = session.exec(_USER_BY_EMAIL, params={"email": email}).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -289,8 +318,9 @@ def resend_verification(
         raise HTTPException(status_code=400, detail="Email already verified")
 
     verification_code = generate_verification_code()
-    verification_hash = hash_password(verification_code)
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=EMAIL_CODE_EXPIRATION_MINUTES)
+    verification_hash = _run_hash(hash_password, verification_code)
+    now = datetime.now(timezone.utc)  # one clock read: created_at and expires_at agree exactly
+    expires_at = now + timedelta(minutes=EMAIL_CODE_EXPIRATION_MINUTES)
 
     verification = session.exec(
         select(EmailVerification).where(EmailVerification.user_id == user.id)
@@ -299,19 +329,20 @@ def resend_verification(
     if verification:
         verification.code_hash = verification_hash
         verification.expires_at = expires_at
-        verification.created_at = datetime.now(timezone.utc)
+        verification.created_at = now
     else:
         verification = EmailVerification(
             user_id=user.id,
             code_hash=verification_hash,
             expires_at=expires_at,
+            created_at=now,
         )
         session.add(verification)
 
+    recipient, name = user.email, user.name  # read before commit expires the instance
     session.commit()
-    session.refresh(user)
 
-    background_tasks.add_task(send_verification_email, user.email, verification_code, user.name)
+    _queue_verification_email(recipient, verification_code, name)
 
     return MessageResponse(message="Verification code resent")
 
@@ -324,7 +355,7 @@ def change_password(
 ) -> MessageResponse:
     user = get_user_from_token(request, session)
     
-    if not verify_password(payload.current_password, user.hashed_password):
+    if not _run_hash(verify_password, payload.current_password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     try:
@@ -332,7 +363,7 @@ def change_password(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-    user.hashed_password = hash_password(payload.new_password)
+    user.hashed_password = _run_hash(hash_password, payload.new_password)
     session.add(user)
     session.commit()
     
@@ -340,28 +371,58 @@ def change_password(
 
 
 @router.post("/logout")
-def logout_user(response: Response):
+def logout_user(request: Request, response: Response):
+    # Revoke rather than just forget the token: a copy of the cookie stops working too
+    revoke_token(request.cookies.get("access_token"))
     delete_auth_cookie(response)
     return {"message": "Logged out successfully"}
 
 @router.get("/me", response_model=UserRead)
-def get_current_user(request: Request, session: Session = Depends(get_session)):
+def get_current_user(request: Request, response: Response, session: Session = Depends(get_session)):
     user = get_user_from_token(request, session)
-    return user
+    # SPAs poll /me on every page load; a weak ETag over the payload lets repeats get a bodiless 304
+    payload = json_utils.dumps(UserRead.model_validate(user).model_dump())
+    etag = f'W/"{hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag})
 
 @router.get("/me/stats")
 def get_user_stats(request: Request, session: Session = Depends(get_session)):
     from app.models import Post, Comment
-    user = get_user_from_token(request, session)
+    # Only the id is needed; resolved from the (cached) token without loading the User row
+    user_id = get_user_id_from_token(request)
     
-    post_count = session.exec(select(Post).where(Post.author_id == user.id)).all()
-    comment_count = session.exec(select(Comment).where(Comment.user_id == user.id)).all()
+    # Both counts in one round-trip, no row hydration
+    post_count, comment_count = session.exec(
+        select(
+            select(func.count()).select_from(Post).where(Post.author_id == user_id).scalar_subquery(),
+            select(func.count()).select_from(Comment).where(Comment.user_id == user_id).scalar_subquery(),
+        )
+    ).one()
     
     return {
-        "posts": len(post_count),
-        "comments": len(comment_count)
+        "posts": post_count,
+        "comments": comment_count
     }
 
 @router.get("/", response_model=list[UserRead])
-def list_users(session: Session = Depends(get_session)):
-    return session.exec(select(User)).all()
+def list_users(
+    session: Session = Depends(get_session),
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    # Only the UserRead columns, serialized directly: no ORM hydration and no per-row
+    # response_model revalidation (response_model is kept for the OpenAPI schema).
+    # Paged so the response never materializes the whole user table.
+    rows = session.exec(
+        select(User.email, User.name, User.id, User.is_verified)
+        .order_by(User.id)
+        .offset(offset)
+        .limit(limit)
+    ).all()
+    payload = [
+        {"email": email, "name": name, "id": user_id, "is_verified": is_verified}
+        for email, name, user_id, is_verified in rows
+    ]
+    return Response(content=json_utils.dumps(payload), media_type="application/json")
@@ -1,18 +1,31 @@
-"""Security helpers for password hashing/verification using bcrypt>=4.
+"""Security helpers for password hashing/verification.
 
-This module avoids passlib and interacts directly with the 'bcrypt' package,
-so it works with bcrypt 4.x where __about__.__version__ was removed.
+New hashes use Argon2id (argon2-cffi) when it is installed; bcrypt>=4 is used
+directly (no passlib) as the fallback and to verify existing $2b$ hashes, which
+are upgraded to Argon2id on the next successful login.
 
 API:
 - hash_password(plain: str) -> str: returns a UTF-8 string hash (modular crypt format)
 - verify_password(plain: str, hashed: str) -> bool
+- verify_and_optionally_rehash(plain: str, hashed: str) -> (bool, new_hash | None)
+- TokenCache(maxsize, ttl): bounded LRU + TTL map used for decoded JWT payloads
+- get_user_id_from_token(request) -> int: validate the auth cookie (cached), no DB access
+- revoke_token(token): reject a token from now until its exp (used by logout)
+- get_user_from_token(request, session) -> User: the above plus the User row, memoized per request
 - get_current_user: Dependency for FastAPI routes to get authenticated user
+
+All routers share this single token cache, so a token decoded for one endpoint is
+a cache hit for every other one.
 """
 from __future__ import annotations
 
 import bcrypt
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
 from fastapi import Request, Depends, HTTPException
-from sqlmodel import Session, select
+from sqlmodel import Session
 import jwt
 import time
 import os
@@ -21,21 +34,112 @@ from dotenv import load_dotenv
 from app.db import get_session
 from app.models import User
 
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except Exception:  # argon2-cffi not installed: keep hashing with bcrypt
+    PasswordHasher = None  # type: ignore
+
+# One hasher for the process; ~tens of ms per hash on a modern core at these settings
+_ARGON2 = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=1) if PasswordHasher else None
+
 load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET", "").strip()
 ALGORITHM = os.getenv("JWT_ALGORITHM", "").strip()
 if not SECRET_KEY or not ALGORITHM:
+    # Fail fast so misconfiguration is caught early
     raise RuntimeError("JWT_SECRET or JWT_ALGORITHM missing in environment")
-
+# Encoded once; PyJWT would otherwise re-encode the str key on every sign/verify
+_SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")
+# Decoder with the claim requirements pre-merged, and a reusable algorithms list
+_JWT_DECODER = jwt.PyJWT(options={"require": ["exp", "sub"]})
+_JWT_ALGORITHMS = [ALGORITHM]
+
+# Cost for the bcrypt fallback; each +1 doubles hash/verify time (bcrypt's default is 12)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Cache decoded tokens to avoid re-decoding / verifying on every single request.
+# NOTE: This introduces a trade-off: revocations (e.g., user deletion) propagate
+# only after the cache TTL. Keep TTL modest.
 TOKEN_CACHE_TTL_SECONDS = int(os.getenv("JWT_CACHE_TTL_SECONDS", "600"))
-_TOKEN_CACHE = {}
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+# Logged-out tokens stay denied until their exp. In-process only, like the cache above;
+# size it above the number of logouts expected within one token lifetime, since an
+# evicted entry makes its token valid again.
+REVOKED_TOKENS_MAX_ENTRIES = int(os.getenv("JWT_REVOKED_MAX_ENTRIES", "100000"))
+
+
+class TokenCache:
+    """Thread-safe LRU map whose entries also expire `ttl` seconds after insertion
+    (or sooner, via set(..., ttl=...), e.g. at the token's own exp).
+
+    Keeps the decoded-token caches bounded: tokens that are never presented again
+    age out of the LRU end instead of staying resident forever. Entries are keyed by a
+    16-byte BLAKE2b digest of the token, so raw bearer tokens aren't kept in memory and
+    keys stay small regardless of token size.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # digest(key) -> (monotonic deadline, value)
+        self._data: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        key = self._digest(key)
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if time.monotonic() >= item[0]:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        key = self._digest(key)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Optional[str], default: Any = None) -> Any:
+        if key is None:
+            return default
+        key = self._digest(key)
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# token -> {"user_id": int, "exp": int(epoch seconds)}; LRU-bounded, entries expire after the TTL or at exp
+_TOKEN_CACHE = TokenCache(TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_TTL_SECONDS)
+# token -> True for logged-out tokens; no TTL cap, each entry expires at its token's exp
+_REVOKED_TOKENS = TokenCache(REVOKED_TOKENS_MAX_ENTRIES, float("inf"))
 
 
 def hash_password(plain_password: str) -> str:
     if plain_password is None:
         raise ValueError("Password cannot be None")
-    # bcrypt requires bytes; generate a salt with default rounds (12)
-    salt = bcrypt.gensalt()  # cost is configurable via rounds=12,14,...
+    if _ARGON2 is not None:
+        return _ARGON2.hash(plain_password)  # $argon2id$...
+    # bcrypt requires bytes; checkpw reads the cost back from the hash, so changing
+    # BCRYPT_ROUNDS only affects newly created hashes
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed: bytes = bcrypt.hashpw(plain_password.encode("utf-8"), salt)
     # Store as utf-8 string (starts with $2b$...)
     return hashed.decode("utf-8")
@@ -44,6 +148,13 @@ def hash_password(plain_password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     if plain_password is None or hashed_password is None:
         return False
+    if hashed_password.startswith("$argon2"):
+        if _ARGON2 is None:
+            return False
+        try:
+            return _ARGON2.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
     try:
         return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
     except ValueError:
@@ -51,15 +162,33 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
-def get_user_from_token(request: Request, session: Session) -> User:
+def verify_and_optionally_rehash(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify, and on success return a replacement hash when the stored one is bcrypt or
+    uses outdated Argon2 parameters (None when it is already current)."""
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if _ARGON2 is None:
+        return True, None
+    if not hashed_password.startswith("$argon2") or _ARGON2.check_needs_rehash(hashed_password):
+        return True, _ARGON2.hash(plain_password)
+    return True, None
+
+
+def get_user_id_from_token(request: Request) -> int:
+    """Validate the auth cookie and return the user id it carries, without a DB lookup."""
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    if _REVOKED_TOKENS.get(token):
+        raise HTTPException(status_code=401, detail="Token revoked")
+
     now = time.time()
     cache_entry = _TOKEN_CACHE.get(token)
 
-    if cache_entry and (now - cache_entry["cached_at"]) < TOKEN_CACHE_TTL_SECONDS:
+    # Fast path: use cached decoded token info (primitive values only)
+    if cache_entry:
+        # Check expiration without re-decoding
         if now >= cache_entry["exp"]:
             _TOKEN_CACHE.pop(token, None)
             raise HTTPException(status_code=401, detail="Token expired")
@@ -67,36 +196,50 @@ def get_user_from_token(request: Request, session: Session) -> User:
         if user_id is None:
             _TOKEN_CACHE.pop(token, None)
             raise HTTPException(status_code=401, detail="Invalid token cache entry")
-        user_obj = session.exec(select(User).where(User.id == int(user_id))).first()
-        if not user_obj:
-            _TOKEN_CACHE.pop(token, None)
-            raise HTTPException(status_code=401, detail="User not found")
-        return user_obj
+        return int(user_id)
 
+    # Slow path: decode JWT anew
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        exp = payload.get("exp")
-        if user_id is None or exp is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
+        payload = _JWT_DECODER.decode(token, _SECRET_KEY_BYTES, algorithms=_JWT_ALGORITHMS)
+        user_id = payload["sub"]
+        exp = payload["exp"]
+    except jwt.MissingRequiredClaimError:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    if now >= exp:
-        raise HTTPException(status_code=401, detail="Token expired")
+    # Entry lives until the cache TTL or the token's own exp, whichever comes first
+    _TOKEN_CACHE.set(token, {"user_id": int(user_id), "exp": int(exp)}, ttl=exp - now)
+    return int(user_id)
 
-    user = session.exec(select(User).where(User.id == int(user_id))).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
 
-    _TOKEN_CACHE[token] = {
-        "user_id": user_id,
-        "exp": exp,
-        "cached_at": now
-    }
+def revoke_token(token: Optional[str]) -> None:
+    """Deny `token` until it expires and drop its memoized decode."""
+    if not token:
+        return
+    try:
+        exp = _JWT_DECODER.decode(token, _SECRET_KEY_BYTES, algorithms=_JWT_ALGORITHMS)["exp"]
+    except (jwt.InvalidTokenError, KeyError):
+        # Forged, malformed or already expired: nothing would accept it anyway
+        return
+    _REVOKED_TOKENS.set(token, True, ttl=exp - time.time())
+    _TOKEN_CACHE.pop(token, None)
 
+
+def get_user_from_token(request: Request, session: Session) -> User:
+    # Resolved once per request (same request.state slot the files/notes helpers use);
+    # only reused while it belongs to this session, to avoid DetachedInstanceError
+    user = getattr(request.state, "user", None)
+    if user is not None and user in session:
+        return user
+    user_id = get_user_id_from_token(request)
+    user = session.get(User, user_id)
+    if not user:
+        _TOKEN_CACHE.pop(request.cookies.get("access_token"), None)
+        raise HTTPException(status_code=401, detail="User not found")
+    request.state.user = user
     return user
 
 
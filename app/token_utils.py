@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import threading
 from pathlib import Path
 from typing import List, Optional, Any
 
@@ -11,14 +12,27 @@ except Exception:
     AutoTokenizer = None
 
 _tokenizer: Optional[Any] = None
+# Set once the first load attempt has finished (successfully or not), so a failed load
+# isn't retried on every call; the lock keeps concurrent first callers (the RAG worker
+# thread vs. chat requests) waiting for that attempt instead of falling back mid-load.
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
 
 
 def get_tokenizer():
     """Return a HuggingFace tokenizer if available, else None."""
-    global _tokenizer
-    if _tokenizer is not None:
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
         return _tokenizer
 
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            _tokenizer = _load_tokenizer()
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def _load_tokenizer():
     if AutoTokenizer is None:
         return None
 
@@ -28,13 +42,10 @@ def get_tokenizer():
 
     try:
         if model_path.exists():
-            _tokenizer = AutoTokenizer.from_pretrained(str(model_path))
-        else:
-            _tokenizer = AutoTokenizer.from_pretrained(emb)
+            return AutoTokenizer.from_pretrained(str(model_path), use_fast=True)
+        return AutoTokenizer.from_pretrained(emb, use_fast=True)
     except Exception:
-        _tokenizer = None
-
-    return _tokenizer
+        return None
 
 
 def encode_text(text: str) -> List[Any]:
@@ -7,24 +7,30 @@ whether an email's domain is in the allowed list.
 from __future__ import annotations
 
 from pathlib import Path
-import json
 import re
+import string
 from functools import lru_cache
 
+from . import json_utils
+
 # Relative paths for this repository layout:
 # - This file: app/validators.py
 # - universities.json: app/assets/universities.json
 UNIVERSITIES_JSON_PATH = Path(__file__).resolve().parent / "assets" / "universities.json"
+# Pre-extracted domains, one per line (written by build_allowed_domains.py); used instead of
+# parsing the JSON whenever it is at least as new as universities.json
+ALLOWED_DOMAINS_PATH = UNIVERSITIES_JSON_PATH.with_name("allowed_domains.txt")
 
 USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9._-]{3,30}$")
 
-SPECIAL_CHARS = r"!@#$%^&*(),.?\":{}|<>_+-"  # used for explanation only
+SPECIAL_CHARS = r"!@#$%^&*(),.?\":{}|<>_+-"
+PASSWORD_MIN_LENGTH = 8
+# Required character classes, checked against the password's set of characters in one pass
 PASSWORD_RULES = [
-    (re.compile(r".{8,}"), "at least 8 characters"),
-    (re.compile(r"[A-Z]"), "an uppercase letter"),
-    (re.compile(r"[a-z]"), "a lowercase letter"),
-    (re.compile(r"[0-9]"), "a digit"),
-    (re.compile(r"[!@#$%^&*(),.?\":{}|<>_+\-]"), "a special character"),
+    (frozenset(string.ascii_uppercase), "an uppercase letter"),
+    (frozenset(string.ascii_lowercase), "a lowercase letter"),
+    (frozenset(string.digits), "a digit"),
+    (frozenset(SPECIAL_CHARS.replace("\\", "")), "a special character"),
 ]
 
 
@@ -42,19 +48,37 @@ def _extract_domains_from_entry(entry: dict) -> set[str]:
     return domains
 
 
-@lru_cache()
-def get_allowed_email_domains() -> set[str]:
-    if not UNIVERSITIES_JSON_PATH.exists():
-        return set()  # no restriction if file absent
+def parse_university_domains() -> frozenset[str]:
+    """All domains listed in universities.json (empty if the file is missing or unreadable)."""
     try:
-        data = json.loads(UNIVERSITIES_JSON_PATH.read_text(encoding="utf-8"))
+        data = json_utils.loads(UNIVERSITIES_JSON_PATH.read_bytes())  # bytes straight to the parser
     except Exception:
-        return set()
+        return frozenset()
     allowed: set[str] = set()
     if isinstance(data, list):
         for entry in data:
             allowed |= _extract_domains_from_entry(entry)
-    return allowed
+    return frozenset(allowed)
+
+
+def _domains_file_is_fresh() -> bool:
+    try:
+        return ALLOWED_DOMAINS_PATH.stat().st_mtime >= UNIVERSITIES_JSON_PATH.stat().st_mtime
+    except OSError:
+        return False
+
+
+@lru_cache()
+def get_allowed_email_domains() -> frozenset[str]:
+    # Built once per process (warmed at app startup); frozen since every request shares it
+    if not UNIVERSITIES_JSON_PATH.exists():
+        return frozenset()  # no restriction if file absent
+    if _domains_file_is_fresh():
+        try:
+            return frozenset(ALLOWED_DOMAINS_PATH.read_text(encoding="utf-8").split())
+        except OSError:
+            pass  # unreadable: fall back to the dataset itself
+    return parse_university_domains()
 
 
 def validate_username(username: str):
@@ -65,11 +89,21 @@ def validate_username(username: str):
 
 
 def validate_password(password: str):
-    missing = [human for regex, human in PASSWORD_RULES if not regex.search(password or "")]
+    password = password or ""
+    chars = set(password)
+    missing = [human for charset, human in PASSWORD_RULES if chars.isdisjoint(charset)]
+    # Length counts within a line, matching the old `.{8,}` rule
+    if not any(len(line) >= PASSWORD_MIN_LENGTH for line in password.split("\n")):
+        missing.insert(0, f"at least {PASSWORD_MIN_LENGTH} characters")
     if missing:
         raise ValueError("Password missing: " + ", ".join(missing))
 
 
+def canonical_email(email: str | None) -> str:
+    """The stored form of an email address: trimmed and lowercased (empty for None)."""
+    return (email or "").strip().lower()
+
+
 def email_domain_allowed(email: str) -> bool:
     if "@" not in email:
         return False
@@ -78,11 +112,22 @@ def email_domain_allowed(email: str) -> bool:
     # If allowed set empty => treat as unrestricted (development convenience)
     if not allowed:
         return True
-    # Accept exact match or subdomain of an allowed domain
-    for d in allowed:
-        if domain == d or domain.endswith("." + d):
-            return True
-    return False
+    # Accept exact match or subdomain of an allowed domain: probe each label suffix
+    # (O(labels) set lookups instead of scanning every allowed domain)
+    parts = domain.split(".")
+    return any(".".join(parts[i:]) in allowed for i in range(len(parts)))
+
+
+@lru_cache(maxsize=4096)
+def university_for_domain(domain: str) -> str | None:
+    """Profile university label for an email domain: its last two labels (e.g. 'ase.ro').
+
+    Memoized: registrations come from a small set of repeating campus domains.
+    """
+    fragments = domain.lower().rsplit(".", 2)
+    if len(fragments) < 2:
+        return None
+    return ".".join(fragments[-2:])
 
 
 def validate_email_domain(email: str):
@@ -0,0 +1,23 @@
+import os
+from pathlib import Path
+from sqlmodel import Session, select
+from app.db import engine
+from app.models import File
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "./uploads")).resolve()
+
+def backfill_file_sizes():
+    # Quota is now a SUM(size) aggregate, so rows uploaded before size was recorded need a value
+    with Session(engine) as session:
+        rows = session.exec(select(File).where(File.size == None)).all()  # noqa: E711
+        for f in rows:
+            try:
+                f.size = os.path.getsize(UPLOAD_DIR / f.filepath)
+            except OSError:
+                f.size = 0
+            session.add(f)
+        session.commit()
+        print(f"✓ Backfilled size for {len(rows)} file row(s)")
+
+if __name__ == "__main__":
+    backfill_file_sizes()
@@ -0,0 +1,11 @@
+from app.validators import ALLOWED_DOMAINS_PATH, parse_university_domains
+
+def build_allowed_domains():
+    # Run after updating app/assets/universities.json; the app then loads this list
+    # at startup instead of parsing and walking the JSON dataset
+    domains = parse_university_domains()
+    ALLOWED_DOMAINS_PATH.write_text("\n".join(sorted(domains)) + "\n", encoding="utf-8")
+    print(f"✓ Wrote {len(domains)} domain(s) to {ALLOWED_DOMAINS_PATH}")
+
+if __name__ == "__main__":
+    build_allowed_domains()
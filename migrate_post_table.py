@@ -1,16 +1,13 @@
-from sqlmodel import Session
-from sqlalchemy import text
 from app.db import engine
 
 def migrate_post_table():
     print("🔄 Starting database migration for post table...")
     
+    # One round-trip for the whole script (psycopg2 accepts multiple statements per execute)
     with engine.begin() as conn:
-        print("  → Dropping existing post table...")
-        conn.execute(text("DROP TABLE IF EXISTS post CASCADE"))
-        
-        print("  → Creating new post table...")
-        conn.execute(text("""
+        print("  → Recreating post table and indexes...")
+        conn.exec_driver_sql("""
+            DROP TABLE IF EXISTS post CASCADE;
             CREATE TABLE post (
                 id SERIAL PRIMARY KEY,
                 title VARCHAR(500) NOT NULL,
@@ -22,12 +19,10 @@ def migrate_post_table():
                 likes INTEGER NOT NULL DEFAULT 0,
                 created_at TIMESTAMP WITH TIME ZONE NOT NULL,
                 updated_at TIMESTAMP WITH TIME ZONE NOT NULL
-            )
-        """))
-        
-        print("  → Creating indexes...")
-        conn.execute(text("CREATE INDEX idx_post_author_id ON post(author_id)"))
-        conn.execute(text("CREATE INDEX idx_post_created_at ON post(created_at DESC)"))
+            );
+            CREATE INDEX idx_post_author_id ON post(author_id);
+            CREATE INDEX idx_post_created_at ON post(created_at DESC);
+        """, execution_options={"no_parameters": True})
         
     print("✅ Migration completed successfully!")
     print("   Post table is now ready to use.")
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_file_owner_size ON file(owner_id, size);
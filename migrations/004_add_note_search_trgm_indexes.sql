@@ -0,0 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_note_title_trgm ON note USING gin (title gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_notetag_tag_trgm ON notetag USING gin (tag gin_trgm_ops);
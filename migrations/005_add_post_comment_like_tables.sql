@@ -0,0 +1,29 @@
+CREATE TABLE IF NOT EXISTS postlike (
+    post_id INTEGER NOT NULL REFERENCES post(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    PRIMARY KEY (post_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS commentlike (
+    comment_id INTEGER NOT NULL REFERENCES comment(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    PRIMARY KEY (comment_id, user_id)
+);
+
+INSERT INTO postlike (post_id, user_id)
+SELECT p.id, liker.user_id::int
+FROM post p
+CROSS JOIN LATERAL json_array_elements_text(COALESCE(NULLIF(p.liked_by, ''), '[]')::json) AS liker(user_id)
+WHERE EXISTS (SELECT 1 FROM "user" u WHERE u.id = liker.user_id::int)
+ON CONFLICT DO NOTHING;
+
+INSERT INTO commentlike (comment_id, user_id)
+SELECT c.id, liker.user_id::int
+FROM comment c
+CROSS JOIN LATERAL json_array_elements_text(COALESCE(NULLIF(c.liked_by, ''), '[]')::json) AS liker(user_id)
+WHERE EXISTS (SELECT 1 FROM "user" u WHERE u.id = liker.user_id::int)
+ON CONFLICT DO NOTHING;
+
+UPDATE post SET likes = (SELECT COUNT(*) FROM postlike pl WHERE pl.post_id = post.id);
+
+UPDATE comment SET likes = (SELECT COUNT(*) FROM commentlike cl WHERE cl.comment_id = comment.id);
@@ -0,0 +1,9 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_studentprofile_name_trgm ON studentprofile USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_studentprofile_username_trgm ON studentprofile USING gin (username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_studentprofile_bio_trgm ON studentprofile USING gin (bio gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_studentprofile_university_trgm ON studentprofile USING gin (university gin_trgm_ops);
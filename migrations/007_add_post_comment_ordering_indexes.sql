@@ -0,0 +1,5 @@
+CREATE INDEX IF NOT EXISTS idx_post_author_created ON post(author_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_post_created_at ON post(created_at);
+
+CREATE INDEX IF NOT EXISTS idx_comment_post_likes_created ON comment(post_id, likes, created_at);
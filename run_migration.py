@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 
 load_dotenv()
 
@@ -14,16 +14,14 @@ def run_migration(sql_file):
     with open(sql_file, 'r') as f:
         sql = f.read()
     
-    statements = [s.strip() for s in sql.split(';') if s.strip()]
-    
+    # psycopg2 runs a multi-statement script in a single round-trip; sent as-is (no
+    # splitting on ';', no bind-param or %-parsing), inside one transaction for atomicity
     with engine.begin() as conn:
-        for statement in statements:
-            try:
-                conn.execute(text(statement))
-                print(f"✅ Executed: {statement[:60].replace(chr(10), ' ')}...")
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                raise
+        try:
+            conn.exec_driver_sql(sql, execution_options={"no_parameters": True})
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            raise
     
     print(f"\n✅ Migration {sql_file} completed successfully!")
 
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Minimal env for app imports (DB + JWT + chatbot). The database and uploads go to a
+# throwaway directory so test runs never touch ./uploads or leave a sqlite file behind.
+_TMP = tempfile.mkdtemp(prefix="mosaic-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP}/test_db.sqlite")
+os.environ.setdefault("UPLOAD_DIR", f"{_TMP}/uploads")
+os.environ.setdefault("JWT_SECRET", "testsecretforjwt1234567890")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("FILE_ENCRYPTION_KEY", "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef")
+os.environ.setdefault("HF_TOKEN", "test-token")
+
+# Ensure repository root is on sys.path so `app` package imports work under pytest
+ROOT = str(Path(__file__).resolve().parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# An email domain listed in app/assets/universities.json, so registration passes the domain check
+UNIVERSITY_DOMAIN = "student.eit.edu.au"
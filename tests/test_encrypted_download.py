@@ -0,0 +1,70 @@
+import io
+import os
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel
+
+from app.main import app
+from app.db import engine
+from app.routers import files
+from conftest import UNIVERSITY_DOMAIN
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_db():
+    SQLModel.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture
+def client():
+    c = TestClient(app)
+    email = f"enc-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}"
+    resp = c.post("/users/register", json={"email": email, "name": f"enc{uuid.uuid4().hex[:8]}", "password": "Aa1!aaaa"})
+    assert resp.status_code == 200, resp.text
+    return c
+
+
+def upload(client, body):
+    resp = client.post("/files/", files={"file": ("data.txt", io.BytesIO(body), "text/plain")})
+    assert resp.status_code == 200, resp.text
+    meta = resp.json()
+    assert meta["is_encrypted"]
+    return meta["id"], files.UPLOAD_DIR / meta["filepath"]
+
+
+def flip_last_byte(path):
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 1]))
+
+
+def test_streamed_download_round_trips(client, monkeypatch):
+    monkeypatch.setattr(files, "MAX_INMEMORY_BYTES", 0)
+    body = os.urandom(3 * files.COPY_CHUNK_BYTES + 17)
+    file_id, _ = upload(client, body)
+    assert client.get(f"/files/{file_id}").content == body
+
+
+def test_streamed_download_rejects_bad_tag_before_sending(client, monkeypatch):
+    # A tag failure must not reach the client as a 200 with a truncated body
+    monkeypatch.setattr(files, "MAX_INMEMORY_BYTES", 0)
+    file_id, path = upload(client, os.urandom(3 * files.COPY_CHUNK_BYTES))
+    flip_last_byte(path)
+    resp = client.get(f"/files/{file_id}")
+    assert resp.status_code == 410
+    assert resp.json()["detail"] == "Unable to decrypt (key mismatch or corrupt)"
+
+
+@pytest.mark.parametrize("keep", [0, 5, files.GCM_NONCE_BYTES + files.GCM_TAG_BYTES - 1])
+def test_in_memory_download_rejects_truncated_file(client, keep):
+    file_id, path = upload(client, b"short note body")
+    with open(path, "r+b") as f:
+        f.truncate(keep)
+    resp = client.get(f"/files/{file_id}")
+    assert resp.status_code == 500
+    assert resp.json()["detail"] == "Corrupt encrypted file"
@@ -0,0 +1,79 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, select
+
+from app.main import app
+from app.db import engine
+from app.models import User
+from app.routers import users
+from conftest import UNIVERSITY_DOMAIN
+
+PASSWORD = "Aa1!aaaa"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_db():
+    SQLModel.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture
+def email():
+    address = f"lock-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}"
+    resp = TestClient(app).post("/users/register", json={"email": address, "name": f"lock{uuid.uuid4().hex[:8]}", "password": PASSWORD})
+    assert resp.status_code == 200, resp.text
+    return address
+
+
+@pytest.fixture
+def hash_calls(monkeypatch):
+    calls = []
+    real = users._run_hash
+
+    def counting(fn, *args):
+        calls.append(fn.__name__)
+        return real(fn, *args)
+
+    monkeypatch.setattr(users, "_run_hash", counting)
+    return calls
+
+
+def login(email, password):
+    return TestClient(app).post("/users/login", json={"email": email, "password": password})
+
+
+def test_lockout_after_max_failures(email):
+    for _ in range(users.MAX_FAILED_LOGIN_ATTEMPTS):
+        assert login(email, "wrong").status_code == 401
+    # Locked: even the right password is refused
+    assert login(email, PASSWORD).status_code == 401
+
+    with Session(engine) as session:
+        user = session.exec(select(User).where(User.email == email)).one()
+        assert user.locked_until is not None
+        user.locked_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+        session.add(user)
+        session.commit()
+
+    assert login(email, PASSWORD).status_code == 200
+    with Session(engine) as session:
+        user = session.exec(select(User).where(User.email == email)).one()
+        assert user.locked_until is None and user.failed_login_attempts == 0
+
+
+def test_locked_account_is_indistinguishable_from_unknown_email(email, hash_calls):
+    for _ in range(users.MAX_FAILED_LOGIN_ATTEMPTS):
+        login(email, "wrong")
+
+    hash_calls.clear()
+    locked = login(email, "wrong")
+    locked_hashes = list(hash_calls)
+
+    hash_calls.clear()
+    unknown = login(f"nobody-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}", "wrong")
+
+    assert (locked.status_code, locked.json()) == (unknown.status_code, unknown.json())
+    assert locked_hashes == hash_calls == ["verify_password"]
@@ -0,0 +1,112 @@
+import io
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, select
+
+from app import rag_engine
+from app.main import app
+from app.db import engine
+from app.models import Note
+from app.routers import notes
+from conftest import UNIVERSITY_DOMAIN
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_db():
+    SQLModel.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture(autouse=True)
+def no_rag(monkeypatch):
+    # Private-note updates queue an index removal; keep the real vector store out of it
+    monkeypatch.setattr(rag_engine, "remove_note_from_index", lambda note_id: None)
+
+
+@pytest.fixture
+def client():
+    c = TestClient(app)
+    email = f"att-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}"
+    resp = c.post("/users/register", json={"email": email, "name": f"att{uuid.uuid4().hex[:8]}", "password": "Aa1!aaaa"})
+    assert resp.status_code == 200, resp.text
+    c.user_id = resp.json()["id"]
+    return c
+
+
+@pytest.fixture
+def failing_write(monkeypatch):
+    # Attachments whose body starts with FAIL blow up mid-write; the rest are stored normally
+    real = notes._atomic_write
+
+    def write(stream, dest_dir, stored_name, nonce=None):
+        if stream.read(4) == b"FAIL":
+            raise OSError("disk full")
+        stream.seek(0)
+        return real(stream, dest_dir, stored_name, nonce=nonce)
+
+    monkeypatch.setattr(notes, "_atomic_write", write)
+
+
+def stored_files():
+    return set(notes.UPLOAD_DIR.iterdir())
+
+
+def attachment(name, body):
+    return ("attachments", (name, io.BytesIO(body), "text/plain"))
+
+
+def test_parallel_attachments_keep_order_and_content(client):
+    bodies = {f"a{i}.txt": f"attachment {i} ".encode() * (i + 1) * 1000 for i in range(5)}
+    resp = client.post("/notes/", data={"title": "Many", "content": "body"},
+                       files=[attachment(name, body) for name, body in bodies.items()])
+    assert resp.status_code == 201, resp.text
+    assert len(resp.json()["attachment_ids"]) == 5
+
+    note = client.get(f"/notes/{resp.json()['id']}").json()
+    assert [a["filename"] for a in note["attachments"]] == list(bodies)
+    for att in note["attachments"]:
+        assert client.get(f"/files/{att['id']}").content == bodies[att["filename"]]
+
+
+def test_failed_attachment_rolls_back_note_and_files(client, failing_write):
+    before = stored_files()
+    resp = client.post("/notes/", data={"title": "Broken", "content": "body"},
+                       files=[attachment("ok1.txt", b"one"), attachment("bad.txt", b"FAIL"), attachment("ok2.txt", b"two")])
+    assert resp.status_code == 500, resp.text
+    # Neither the content file nor the attachments that did land are left behind
+    assert stored_files() == before
+    with Session(engine) as session:
+        assert session.exec(select(Note).where(Note.user_id == client.user_id)).all() == []
+
+
+def test_failed_attachment_on_update_keeps_note_unchanged(client, failing_write):
+    created = client.post("/notes/", data={"title": "Stable", "content": "body"}).json()
+    before = stored_files()
+    resp = client.put(f"/notes/{created['id']}", data={"title": "Renamed"},
+                      files=[("new_attachments", ("ok.txt", io.BytesIO(b"ok"), "text/plain")),
+                             ("new_attachments", ("bad.txt", io.BytesIO(b"FAIL"), "text/plain"))])
+    assert resp.status_code == 500, resp.text
+    assert stored_files() == before
+    note = client.get(f"/notes/{created['id']}").json()
+    assert note["title"] == "Stable" and note["attachments"] == []
+
+
+def test_failed_update_keeps_old_content_downloadable(client, failing_write):
+    created = client.post("/notes/", data={"title": "Kept", "content": "original body"}).json()
+    resp = client.put(f"/notes/{created['id']}", data={"content": "new body"},
+                      files=[("new_attachments", ("bad.txt", io.BytesIO(b"FAIL"), "text/plain"))])
+    assert resp.status_code == 500, resp.text
+    note = client.get(f"/notes/{created['id']}").json()
+    assert note["content_file_id"] == created["content_file_id"]
+    download = client.get(f"/files/{created['content_file_id']}")
+    assert download.status_code == 200 and download.content == b"original body"
+
+
+def test_successful_update_removes_replaced_content(client):
+    created = client.post("/notes/", data={"title": "Swap", "content": "old"}).json()
+    before = stored_files()
+    assert client.put(f"/notes/{created['id']}", data={"content": "new"}).status_code == 200
+    after = stored_files()
+    assert len(after) == len(before) and after != before
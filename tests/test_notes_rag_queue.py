@@ -0,0 +1,82 @@
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel
+
+from app.main import app
+from app.db import engine
+from app import rag_engine
+from app.routers import notes
+from conftest import UNIVERSITY_DOMAIN
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_db():
+    SQLModel.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture
+def client():
+    c = TestClient(app)
+    email = f"rag-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}"
+    resp = c.post("/users/register", json={"email": email, "name": f"rag{uuid.uuid4().hex[:8]}", "password": "Aa1!aaaa"})
+    assert resp.status_code == 200, resp.text
+    return c
+
+
+@pytest.fixture
+def rag_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rag_engine, "index_note_from_content", lambda **kw: calls.append(("index_content", kw)))
+    monkeypatch.setattr(rag_engine, "index_note", lambda **kw: calls.append(("index", kw)))
+    monkeypatch.setattr(rag_engine, "remove_note_from_index", lambda note_id: calls.append(("remove", note_id)))
+    return calls
+
+
+def drain_rag_worker():
+    # Single worker, FIFO: once this no-op has run every earlier job has too
+    notes._rag_worker.submit(lambda: None).result(timeout=10)
+
+
+def test_public_note_is_indexed_on_create(client, rag_calls):
+    resp = client.post("/notes/", data={"title": "Public", "content": "# body", "visibility": "public", "tags": json.dumps([])})
+    assert resp.status_code == 201, resp.text
+    drain_rag_worker()
+    note_id = resp.json()["id"]
+    assert rag_calls == [("index_content", {
+        "note_id": note_id,
+        "note_title": "Public",
+        "owner_id": rag_calls[0][1]["owner_id"],
+        "content_text": "# body",
+        "attachments": [],
+    })]
+
+
+def test_visibility_changes_queue_index_and_remove(client, rag_calls):
+    resp = client.post("/notes/", data={"title": "Private", "content": "text", "visibility": "private"})
+    assert resp.status_code == 201, resp.text
+    note_id = resp.json()["id"]
+    drain_rag_worker()
+    assert rag_calls == []
+
+    assert client.put(f"/notes/{note_id}", data={"visibility": "public"}).status_code == 200
+    drain_rag_worker()
+    assert [c[0] for c in rag_calls] == ["index"]
+    assert rag_calls[0][1]["note_id"] == note_id
+
+    assert client.put(f"/notes/{note_id}", data={"visibility": "private"}).status_code == 200
+    drain_rag_worker()
+    assert rag_calls[1] == ("remove", note_id)
+
+
+def test_failing_job_does_not_stop_the_worker(rag_calls):
+    def boom():
+        raise RuntimeError("embedding model down")
+
+    notes._queue_rag_job("index", 1, boom)
+    notes._queue_rag_job("remove", 1, rag_engine.remove_note_from_index, 1)
+    drain_rag_worker()
+    assert rag_calls == [("remove", 1)]
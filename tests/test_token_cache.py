@@ -0,0 +1,105 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+from sqlmodel import Session, SQLModel
+
+from app import security
+from app.main import app
+from app.db import engine
+from app.models import User
+from app.routers.users import create_access_token
+from app.security import TokenCache
+from conftest import UNIVERSITY_DOMAIN
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(security.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TokenCache(maxsize=10, ttl=60)
+    cache["tok"] = {"user_id": 1}
+    clock[0] += 59
+    assert cache.get("tok") == {"user_id": 1}
+    clock[0] += 1
+    assert cache.get("tok") is None
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_is_capped_by_cache_ttl(clock):
+    cache = TokenCache(maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=5)
+    cache.set("long", 2, ttl=3600)
+    clock[0] += 5
+    assert cache.get("short") is None
+    clock[0] += 54
+    assert cache.get("long") == 2
+    clock[0] += 1
+    assert cache.get("long") is None
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache["c"] = 3
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_revoked_token_entry_lives_until_exp(clock):
+    token = security.jwt.encode({"sub": "1", "exp": int(security.time.time()) + 7200}, security._SECRET_KEY_BYTES, algorithm=security.ALGORITHM)
+    security.revoke_token(token)
+    clock[0] += 7000  # well past the decode cache's TTL
+    assert security._REVOKED_TOKENS.get(token)
+    clock[0] += 300
+    assert security._REVOKED_TOKENS.get(token) is None
+
+
+def test_pop(clock):
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache["a"] = 1
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    assert cache.pop(None, "none") == "none"
+
+
+def test_logout_revokes_token_and_deleted_user_drops_it():
+    SQLModel.metadata.create_all(engine)
+    client = TestClient(app)
+    email = f"tok-{uuid.uuid4().hex[:8]}@{UNIVERSITY_DOMAIN}"
+    resp = client.post("/users/register", json={"email": email, "name": f"tok{uuid.uuid4().hex[:8]}", "password": "Aa1!aaaa"})
+    assert resp.status_code == 200
+    user_id = resp.json()["id"]
+    token = client.cookies.get("access_token")
+
+    assert client.get("/users/me").status_code == 200
+    assert security._TOKEN_CACHE.get(token) is not None
+
+    client.post("/users/logout")
+    assert security._TOKEN_CACHE.get(token) is None
+
+    # A copy of the logged-out cookie is refused, not just re-decoded
+    client.cookies.set("access_token", token)
+    resp = client.get("/users/me")
+    assert resp.status_code == 401
+    assert resp.json()["detail"] == "Token revoked"
+
+    # Account gone while its token is still cached: 401 and the entry is evicted
+    # Different exp, so not byte-identical to the revoked token issued in the same second
+    token = create_access_token(data={"sub": str(user_id)}, expires_delta=timedelta(minutes=5))
+    client.cookies.set("access_token", token)
+    assert client.get("/users/me").status_code == 200
+    with Session(engine) as session:
+        session.exec(delete(User).where(User.email == email))
+        session.commit()
+    assert client.get("/users/me").status_code == 401
+    assert security._TOKEN_CACHE.get(token) is None